@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Playwright浏览器安装
+启动器与主程序共用：按已安装的浏览器版本判断是否需要安装，
+安装过程异步执行并逐行输出进度，不阻塞事件循环
+"""
+
+import asyncio
+import os
+import re
+import sys
+
+BROWSER = "chromium"
+INSTALL_MARKER = "INSTALLATION_COMPLETE"  # playwright安装完成后写入的标记文件
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")  # 进度输出中的终端颜色控制码
+
+
+def default_python_cmd():
+    """当前解释器"""
+    return [sys.executable]
+
+
+def clean_line(raw):
+    """解码一行输出并去掉终端控制码，避免写入日志文件"""
+    return ANSI_ESCAPE.sub("", raw.decode("utf-8", errors="replace")).strip()
+
+
+async def run_playwright(python_cmd, args, on_line=None, timeout=None):
+    """运行 playwright 命令，逐行回调输出，返回 (退出码, 全部输出行)"""
+    process = await asyncio.create_subprocess_exec(
+        *python_cmd,
+        "-m",
+        "playwright",
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    lines = []
+
+    async def read_output():
+        buffer = b""
+        while True:
+            chunk = await process.stdout.read(1024)
+            if not chunk:
+                break
+            # 下载进度条用 \r 刷新同一行，按 \r 和 \n 切分
+            buffer += chunk.replace(b"\r", b"\n")
+            *complete, buffer = buffer.split(b"\n")
+            for raw in complete:
+                line = clean_line(raw)
+                if line:
+                    lines.append(line)
+                    if on_line:
+                        on_line(line)
+        line = clean_line(buffer)
+        if line:
+            lines.append(line)
+            if on_line:
+                on_line(line)
+        return await process.wait()
+
+    try:
+        returncode = await asyncio.wait_for(read_output(), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        process.kill()
+        await process.wait()
+        raise
+    return returncode, lines
+
+
+async def install_locations(python_cmd=None):
+    """通过 `playwright install --dry-run` 获取当前版本浏览器的安装目录
+
+    目录名包含浏览器修订号（如 chromium-1248），升级playwright后自动变化。
+    不支持 --dry-run 的旧版本返回 None。
+    """
+    try:
+        returncode, lines = await run_playwright(
+            python_cmd or default_python_cmd(),
+            ["install", "--dry-run", BROWSER],
+            timeout=60,
+        )
+    except Exception:
+        return None
+    if returncode != 0:
+        return None
+    locations = []
+    for line in lines:
+        match = re.match(r"Install location:\s*(.+)$", line)
+        if match:
+            locations.append(match.group(1).strip())
+    return locations or None
+
+
+def is_installed(locations):
+    """各安装目录都已完整安装"""
+    return all(
+        os.path.exists(os.path.join(location, INSTALL_MARKER)) for location in locations
+    )
+
+
+async def ensure_browser(python_cmd=None, on_progress=None, timeout=600):
+    """当前修订号的浏览器未安装时异步安装，返回是否可用"""
+    python_cmd = python_cmd or default_python_cmd()
+    locations = await install_locations(python_cmd)
+    if locations and is_installed(locations):
+        if on_progress:
+            revisions = ", ".join(os.path.basename(path) for path in locations)
+            on_progress(f"浏览器已安装 ({revisions})")
+        return True
+
+    if on_progress:
+        on_progress("正在安装Playwright浏览器，这可能需要几分钟...")
+    last_line = None
+
+    def report(line):
+        nonlocal last_line
+        # 进度条会重复输出相同内容，只回调变化的行
+        if on_progress and line != last_line:
+            last_line = line
+            on_progress(line)
+
+    try:
+        returncode, lines = await run_playwright(
+            python_cmd, ["install", BROWSER], on_line=report, timeout=timeout
+        )
+    except asyncio.TimeoutError:
+        if on_progress:
+            on_progress("浏览器安装超时")
+        return False
+    except Exception as e:
+        if on_progress:
+            on_progress(f"安装浏览器时出错: {e}")
+        return False
+
+    if returncode != 0:
+        if on_progress:
+            errors = [line for line in lines if line.startswith("Error")]
+            on_progress(f"浏览器安装失败: {errors[0] if errors else returncode}")
+        return False
+    return True
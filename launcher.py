@@ -5,6 +5,7 @@ LABUBU商品搜索程序启动器
 跨平台自动环境检查和配置工具
 """
 
+import asyncio
 import os
 import sys
 import platform
@@ -15,6 +16,8 @@ import tempfile
 from pathlib import Path
 import json
 
+import browser_install
+
 
 class LabubuLauncher:
     def __init__(self):
@@ -33,7 +36,6 @@ class LabubuLauncher:
         # 标记文件都保存在工作目录
         self.pip_upgraded_flag = self.script_dir / ".pip_upgraded"
         self.deps_installed_flag = self.script_dir / ".deps_installed"
-        self.browser_installed_flag = self.script_dir / ".browser_installed"
 
         print("🎭 LABUBU商品搜索程序启动器")
         print("=" * 50)
@@ -322,28 +324,23 @@ class LabubuLauncher:
         return True
 
     def install_playwright_browser(self):
-        """安装Playwright浏览器"""
-        if self.browser_installed_flag.exists():
-            self.print_success("Playwright浏览器已安装，跳过安装步骤")
-            return True
-
-        self.print_step("安装Playwright浏览器...")
+        """安装Playwright浏览器（与主程序共用，按已安装的浏览器版本判断）"""
+        self.print_step("检查Playwright浏览器...")
 
         try:
-            cmd = self.python_cmd.split() + ["-m", "playwright", "install", "chromium"]
-            result = self.run_command(cmd)
-
-            if result.returncode == 0:
-                self.browser_installed_flag.write_text(
-                    "Playwright browser installed successfully"
+            ready = asyncio.run(
+                browser_install.ensure_browser(
+                    self.python_cmd.split(),
+                    on_progress=lambda line: print(f"📥 {line}"),
                 )
-                self.print_success("Playwright浏览器安装完成")
-                return True
+            )
+            if ready:
+                self.print_success("Playwright浏览器已就绪")
             else:
                 self.print_warning(
                     "Playwright浏览器安装失败，程序会在运行时自动尝试安装"
                 )
-                return True
+            return True
 
         except Exception as e:
             self.print_warning(f"Playwright浏览器安装出错: {e}")
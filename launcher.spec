@@ -8,9 +8,12 @@ a = Analysis(
         ('config.yaml', '.'),
         ('requirements.txt', '.'),
         ('main.py', '.'),
+        ('browser_install.py', '.'),
     ],
     hiddenimports=[
         'yaml',
+        'asyncio',
+        'browser_install',
         'urllib.request',
         'tempfile',
         'json',
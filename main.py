@@ -5,15 +5,39 @@
 注意：这是一个演示程序，不会实际执行购买操作
 """
 
+import argparse
 import asyncio
+import base64
+import cProfile
+import json
 import logging
+import multiprocessing
+import pstats
+import queue
 import random
-import subprocess
+import shutil
+import signal
+import sqlite3
+import struct
 import sys
 import os
+import threading
+import time
+import traceback
+import unicodedata
+import requests
 import yaml
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 from playwright.async_api import async_playwright
 
+import browser_install
+
 # Windows平台的声音模块
 try:
     import winsound
@@ -30,24 +54,2216 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class Detection:
+    """单个商品命中事件"""
+
+    keyword: str
+    text: str
+    goods_num: Optional[str] = None
+    index: int = 0
+    selector: str = ""
+    room: str = ""
+    detected_at: float = field(default_factory=time.time)
+
+    def to_dict(self):
+        """转换为字典（用于汇总展示和跨进程传递）"""
+        return asdict(self)
+
+
+class DetectionSubscription:
+    """watch() 订阅者的有界事件队列"""
+
+    def __init__(self, maxsize=100, overflow="block"):
+        self.queue = asyncio.Queue(maxsize)
+        self.overflow = overflow  # block: 反压生产者; drop_oldest: 丢弃最旧事件
+        self.dropped = 0
+
+    async def put(self, detection):
+        """写入事件，队列已满时按策略处理"""
+        if self.overflow == "drop_oldest":
+            while self.queue.full():
+                self.queue.get_nowait()
+                self.dropped += 1
+        await self.queue.put(detection)
+
+    async def get(self):
+        """读取下一个事件"""
+        return await self.queue.get()
+
+    def get_nowait(self):
+        """非阻塞读取事件"""
+        return self.queue.get_nowait()
+
+    def empty(self):
+        """队列是否为空"""
+        return self.queue.empty()
+
+
+class CronRule:
+    """简化的cron规则：分 时 日 月 周（支持 * , - / 语法，按本地时间计算）"""
+
+    # 周字段允许0-7，其中0和7都表示周日
+    RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron表达式需要5个字段: {expression}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = [
+            self.parse_field(text, low, high)
+            for text, (low, high) in zip(fields, self.RANGES)
+        ]
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        # 与标准cron一致：日和周同时受限时满足其一即可
+        self.day_restricted = fields[2] != "*"
+        self.weekday_restricted = fields[4] != "*"
+
+    @staticmethod
+    def parse_field(text, low, high):
+        """解析单个cron字段为取值集合"""
+        values = set()
+        for part in text.split(","):
+            step = 1
+            if "/" in part:
+                part, step_text = part.split("/", 1)
+                step = int(step_text)
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(value) for value in part.split("-", 1))
+            else:
+                start = int(part)
+                end = high if step != 1 else start
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"cron字段超出范围: {text}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def matches_day(self, day):
+        """判断某天是否满足日/月/周约束"""
+        if day.month not in self.months:
+            return False
+        day_ok = day.day in self.days
+        weekday_ok = (day.weekday() + 1) % 7 in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, timestamp):
+        """返回严格晚于timestamp的下一次触发时间戳"""
+        now = datetime.fromtimestamp(timestamp)
+        for offset in range(367):
+            day = (now + timedelta(days=offset)).date()
+            if not self.matches_day(day):
+                continue
+            for hour in sorted(self.hours):
+                for minute in sorted(self.minutes):
+                    candidate = datetime(day.year, day.month, day.day, hour, minute)
+                    if candidate.timestamp() > timestamp:
+                        return candidate.timestamp()
+        return None
+
+    def previous_before(self, timestamp, lookback):
+        """返回lookback秒内最近一次不晚于timestamp的触发时间戳"""
+        start = self.next_after(timestamp - lookback - 1)
+        latest = None
+        while start is not None and start <= timestamp:
+            latest = start
+            start = self.next_after(start)
+        return latest
+
+
+class DropWindowScheduler:
+    """发售窗口调度：窗口外低频空闲，临近窗口预热，窗口内切换到最快模式"""
+
+    def __init__(self, monitoring_config):
+        schedule_config = monitoring_config.get("schedule", {})
+        self.min_interval = monitoring_config["min_interval"]
+        self.max_interval = monitoring_config["max_interval"]
+        self.ramp_up = schedule_config.get("ramp_up", 120)
+        self.idle_interval = schedule_config.get("idle_interval", 300)
+        self.fast_min_interval = schedule_config.get("fast_min_interval", 1)
+        self.fast_max_interval = schedule_config.get("fast_max_interval", 3)
+        self.fixed_windows = []  # [(开始时间戳, 结束时间戳)]
+        self.cron_windows = []  # [(CronRule, 持续秒数)]
+
+        for window in schedule_config.get("drop_windows") or []:
+            duration = window.get("duration", 600)
+            if "at" in window:
+                start = self.parse_time(window["at"])
+                self.fixed_windows.append((start, start + duration))
+            elif "cron" in window:
+                self.cron_windows.append((CronRule(window["cron"]), duration))
+            else:
+                raise ValueError(f"发售窗口需要配置 at 或 cron: {window}")
+
+    def add_cron_window(self, expression, duration):
+        """追加一个cron规则的发售窗口"""
+        self.cron_windows.append((CronRule(expression), duration))
+
+    @staticmethod
+    def parse_time(value):
+        """解析绝对时间（YAML时间戳或 'YYYY-MM-DD HH:MM[:SS]' 字符串，本地时间）"""
+        if isinstance(value, datetime):
+            return value.timestamp()
+        if isinstance(value, (int, float)):
+            return float(value)
+        return datetime.fromisoformat(str(value)).timestamp()
+
+    @property
+    def enabled(self):
+        """是否配置了发售窗口"""
+        return bool(self.fixed_windows or self.cron_windows)
+
+    def current_window(self, now):
+        """返回当前所处的窗口，没有则返回None"""
+        for start, end in self.fixed_windows:
+            if start <= now < end:
+                return start, end
+        for rule, duration in self.cron_windows:
+            start = rule.previous_before(now, duration)
+            if start is not None and now < start + duration:
+                return start, start + duration
+        return None
+
+    def next_window(self, now):
+        """返回下一个尚未开始的窗口，没有则返回None"""
+        starts = [(start, end) for start, end in self.fixed_windows if start > now]
+        for rule, duration in self.cron_windows:
+            start = rule.next_after(now)
+            if start is not None:
+                starts.append((start, start + duration))
+        return min(starts) if starts else None
+
+    def phase(self, now):
+        """当前阶段：normal（未配置窗口）/ active / ramp / idle"""
+        if not self.enabled:
+            return "normal"
+        if self.current_window(now):
+            return "active"
+        upcoming = self.next_window(now)
+        if upcoming and upcoming[0] - now <= self.ramp_up:
+            return "ramp"
+        return "idle"
+
+    def next_wait(self, now):
+        """本次检查结束后到下次检查的等待秒数"""
+        phase = self.phase(now)
+        if phase == "normal":
+            return random.randint(self.min_interval, self.max_interval)
+        if phase in ("active", "ramp"):
+            return random.uniform(self.fast_min_interval, self.fast_max_interval)
+
+        # 空闲阶段：低频检查，但不错过下一个窗口的预热时间
+        upcoming = self.next_window(now)
+        wait_time = self.idle_interval
+        if upcoming:
+            wait_time = min(wait_time, max(0, upcoming[0] - self.ramp_up - now))
+        return wait_time
+
+
+class ServerClock:
+    """根据响应Date头和往返时间估计本地时钟与服务器时钟的偏移
+
+    Date头只有秒级精度：一次请求说明服务器时间在 [date, date+1) 内，且生成于
+    请求发出与响应返回之间，因此偏移落在 [date - t1, date + 1 - t0] 区间。
+    多次采样时错开亚秒相位，取低延迟样本的区间交集即可把不确定度压到往返时间量级。
+    """
+
+    def __init__(self, url, samples=12, keep_ratio=0.6, request_timeout=3):
+        self.url = url
+        self.samples = samples
+        self.keep_ratio = keep_ratio
+        self.request_timeout = request_timeout
+        self.offset = 0.0  # 服务器时间 - 本地时间（秒）
+        self.uncertainty = float("inf")  # 偏移的不确定度（秒）
+        self.synced_at = None
+        # 以单调时钟换算本地时间，避免系统时间跳变影响
+        self.anchor_wall = time.time()
+        self.anchor_perf = time.perf_counter()
+
+    def local_time(self, perf=None):
+        """由单调时钟换算的本地时间戳"""
+        if perf is None:
+            perf = time.perf_counter()
+        return self.anchor_wall + (perf - self.anchor_perf)
+
+    def now(self):
+        """估计的当前服务器时间戳"""
+        return self.local_time() + self.offset
+
+    def sample(self):
+        """发送一次HEAD请求，返回 (偏移下界, 偏移上界, 往返时间)"""
+        t0 = time.perf_counter()
+        response = requests.head(
+            self.url, timeout=self.request_timeout, allow_redirects=False
+        )
+        t1 = time.perf_counter()
+        date_header = response.headers.get("Date")
+        if not date_header:
+            raise ValueError(f"响应缺少Date头: {self.url}")
+        server_second = parsedate_to_datetime(date_header).timestamp()
+        return (
+            server_second - self.local_time(t1),
+            server_second + 1 - self.local_time(t0),
+            t1 - t0,
+        )
+
+    @staticmethod
+    def estimate(intervals, keep_ratio=0.6):
+        """过滤高延迟样本后求区间交集，返回 (偏移, 不确定度)"""
+        if not intervals:
+            raise ValueError("没有可用的时钟样本")
+        ranked = sorted(intervals, key=lambda interval: interval[2])
+        kept = ranked[: max(1, int(len(ranked) * keep_ratio))]
+
+        low = max(interval[0] for interval in kept)
+        high = min(interval[1] for interval in kept)
+        if low <= high:
+            return (low + high) / 2, (high - low) / 2
+
+        # 样本互相矛盾（网络抖动或服务器时间跳变）：退化为中位数估计
+        midpoints = sorted((interval[0] + interval[1]) / 2 for interval in kept)
+        median = midpoints[len(midpoints) // 2]
+        spread = max(abs(midpoint - median) for midpoint in midpoints)
+        return median, max(spread, 0.5)
+
+    def sync_blocking(self):
+        """同步采样并更新偏移估计（在线程中执行）"""
+        intervals = []
+        for i in range(self.samples):
+            try:
+                intervals.append(self.sample())
+            except Exception as e:
+                logger.warning(f"⚠️ 时钟采样失败: {e}")
+            # 错开亚秒相位，使不同样本落在Date秒边界的不同位置
+            if i < self.samples - 1:
+                time.sleep(1.0 / self.samples + random.uniform(0, 0.01))
+
+        self.offset, self.uncertainty = self.estimate(intervals, self.keep_ratio)
+        self.synced_at = time.perf_counter()
+        return self.offset, self.uncertainty
+
+    async def sync(self):
+        """异步更新偏移估计"""
+        try:
+            offset, uncertainty = await asyncio.to_thread(self.sync_blocking)
+            logger.info(
+                f"⏱️ 服务器时钟偏移 {offset * 1000:+.1f} ms (±{uncertainty * 1000:.1f} ms)"
+            )
+            return True
+        except Exception as e:
+            logger.error(f"❌ 服务器时钟同步失败: {e}")
+            return False
+
+    def is_stale(self, max_age):
+        """距离上次同步是否超过max_age秒"""
+        return self.synced_at is None or time.perf_counter() - self.synced_at > max_age
+
+    async def wait_until(self, server_ts, spin_window=0.015):
+        """等待到指定的服务器时间，返回实际迟到的毫秒数
+
+        先用asyncio.sleep粗等到目标前spin_window秒，再以让出事件循环的方式
+        自旋到目标时刻，调度精度可达毫秒级。
+        """
+        target = self.anchor_perf + (server_ts - self.offset - self.anchor_wall)
+        while True:
+            remaining = target - time.perf_counter()
+            if remaining <= 0:
+                return -remaining * 1000
+            if remaining > spin_window:
+                await asyncio.sleep(remaining - spin_window)
+            else:
+                await asyncio.sleep(0)
+
+
+class KeywordPlanner:
+    """按优先级、权重和历史命中率为每轮检查规划要搜索的关键字
+
+    每个关键字每轮累积一次"有效权重"作为积分，积分满1时本轮搜索该关键字。
+    有效权重 = 配置权重 × 优先级系数 × 命中率系数 × 连续未命中退避系数，
+    因此高优先级、高权重、常命中的关键字几乎每轮都搜索，长期未命中的关键字逐渐降频。
+    发售窗口内（fast模式）不做降频，每轮按优先级搜索全部关键字。
+    """
+
+    def __init__(self, entries, scheduling_config=None):
+        scheduling_config = scheduling_config or {}
+        self.backoff_after = scheduling_config.get("backoff_after", 5)
+        self.min_factor = scheduling_config.get("min_factor", 0.1)
+
+        self.keywords = {}  # 关键字 -> {"priority": int, "weight": float}
+        for entry in entries:
+            if isinstance(entry, str):
+                entry = {"keyword": entry}
+            self.keywords[entry["keyword"]] = {
+                "priority": entry.get("priority", 0),
+                "weight": float(entry.get("weight", 1.0)),
+            }
+        self.max_weight = max(
+            (settings["weight"] for settings in self.keywords.values()), default=1.0
+        )
+        self.max_priority = max(
+            (settings["priority"] for settings in self.keywords.values()), default=0
+        )
+        self.stats = {
+            keyword: {"scans": 0, "hits": 0, "miss_streak": 0, "last_hit_at": None}
+            for keyword in self.keywords
+        }
+        self.credits = {keyword: 0.0 for keyword in self.keywords}
+
+    def hit_rate(self, keyword):
+        """平滑后的命中率（无历史时为0.5）"""
+        stats = self.stats[keyword]
+        return (stats["hits"] + 1) / (stats["scans"] + 2)
+
+    def priority_factor(self, keyword):
+        """优先级系数（1~2）：优先级最高的关键字积分累积速度是无优先级关键字的两倍"""
+        if self.max_priority <= 0:
+            return 1.0
+        return 1.0 + max(0, self.keywords[keyword]["priority"]) / self.max_priority
+
+    def effective_weight(self, keyword):
+        """本轮的有效权重（0~1）"""
+        base = self.keywords[keyword]["weight"] / self.max_weight
+        backoff = max(
+            self.min_factor,
+            0.5 ** (self.stats[keyword]["miss_streak"] // self.backoff_after),
+        )
+        return min(
+            1.0,
+            base
+            * self.priority_factor(keyword)
+            * backoff
+            * (0.5 + self.hit_rate(keyword)),
+        )
+
+    def by_priority(self, keywords):
+        """按优先级、有效权重从高到低排序"""
+        return sorted(
+            keywords,
+            key=lambda keyword: (
+                -self.keywords[keyword]["priority"],
+                -self.effective_weight(keyword),
+            ),
+        )
+
+    def reset_backoff(self):
+        """清除连续未命中退避（进入或离开发售窗口时调用）"""
+        for keyword, stats in self.stats.items():
+            stats["miss_streak"] = 0
+            self.credits[keyword] = 0.0
+
+    def plan(self, fast=False):
+        """返回本轮要搜索的关键字列表（按优先级从高到低）
+
+        fast 为 True（发售窗口及其预热阶段）时不降频，返回全部关键字。
+        """
+        if fast:
+            return self.by_priority(self.keywords)
+
+        selected = []
+        for keyword in self.keywords:
+            self.credits[keyword] += self.effective_weight(keyword)
+            if self.credits[keyword] >= 1.0:
+                self.credits[keyword] -= 1.0
+                selected.append(keyword)
+
+        if not selected and self.keywords:
+            # 保证每轮至少搜索一个关键字
+            keyword = max(self.credits, key=self.credits.get)
+            self.credits[keyword] = 0.0
+            selected.append(keyword)
+
+        return self.by_priority(selected)
+
+    def record(self, keyword, hit):
+        """记录一次搜索结果"""
+        stats = self.stats.get(keyword)
+        if stats is None:
+            return
+        stats["scans"] += 1
+        if hit:
+            stats["hits"] += 1
+            stats["miss_streak"] = 0
+            stats["last_hit_at"] = time.time()
+        else:
+            stats["miss_streak"] += 1
+
+    def boost(self, keyword):
+        """让关键字在下一轮必定被搜索（例如其它实例刚发现了该商品）"""
+        if keyword in self.credits:
+            self.credits[keyword] = max(self.credits[keyword], 1.0)
+
+    def seed(self, history_stats):
+        """用历史统计初始化命中数据 {关键字: {"scans": n, "hits": m}}"""
+        for keyword, values in history_stats.items():
+            if keyword in self.stats:
+                self.stats[keyword]["scans"] = values.get("scans", 0)
+                self.stats[keyword]["hits"] = values.get("hits", 0)
+
+
+def decode_json_frame(payload):
+    """解码JSON文本帧"""
+    if isinstance(payload, bytes):
+        payload = payload.decode("utf-8")
+    return [json.loads(payload)]
+
+
+def decode_length_prefixed_frame(payload):
+    """解码长度前缀二进制帧：若干个 [4字节大端长度][UTF-8 JSON消息体]"""
+    if isinstance(payload, str):
+        return []
+    messages = []
+    offset = 0
+    while offset + 4 <= len(payload):
+        (length,) = struct.unpack_from(">I", payload, offset)
+        offset += 4
+        body = payload[offset : offset + length]
+        offset += length
+        if len(body) < length:
+            break
+        try:
+            messages.append(json.loads(body.decode("utf-8")))
+        except (UnicodeDecodeError, ValueError):
+            continue
+    return messages
+
+
+# WebSocket帧解码器注册表：名称 -> 解码函数(payload) -> 消息对象列表
+FRAME_DECODERS = {
+    "json": decode_json_frame,
+    "length_prefixed": decode_length_prefixed_frame,
+}
+
+
+def register_frame_decoder(name, decoder):
+    """注册自定义WebSocket帧解码器"""
+    FRAME_DECODERS[name] = decoder
+
+
+class WebSocketListener:
+    """监听直播间WebSocket推送，从商品上架/库存消息中直接匹配关键字"""
+
+    def __init__(self, searcher, websocket_config):
+        self.searcher = searcher
+        self.url_filter = websocket_config.get("url_filter", "")
+        self.decoders = [
+            FRAME_DECODERS[name]
+            for name in websocket_config.get("decoders", ["json", "length_prefixed"])
+        ]
+        self.title_fields = websocket_config.get(
+            "title_fields", ["title", "itemTitle", "itemName"]
+        )
+        self.goods_num_fields = websocket_config.get(
+            "goods_num_fields", ["goodsIndex", "itemIndex", "goodsNum"]
+        )
+        self.url_fields = websocket_config.get(
+            "url_fields", ["itemUrl", "itemH5Url", "url"]
+        )
+        self.dedup_seconds = websocket_config.get("dedup_seconds", 60)
+        self.report_interval = websocket_config.get("report_interval", 300)
+        self.attached_pages = set()
+        self.recent = {}  # 商品标识 -> 最近一次触发时间
+        self.pruned_at = time.time()
+        self.frame_count = 0  # 上次报告以来收到的帧数
+        self.hit_count = 0  # 上次报告以来的命中数
+        self.reported_at = time.time()
+
+    def attach(self, page):
+        """在页面上注册WebSocket监听，返回是否为首次注册"""
+        if id(page) in self.attached_pages:
+            return False
+        self.attached_pages.add(id(page))
+        page.on("websocket", self.on_websocket)
+        return True
+
+    def on_websocket(self, websocket):
+        """新的WebSocket连接"""
+        if self.url_filter and self.url_filter not in websocket.url:
+            return
+        logger.info(f"🔌 监听WebSocket: {websocket.url}")
+        websocket.on("framereceived", self.on_frame)
+
+    def decode(self, payload):
+        """依次尝试各个解码器，返回第一个成功解码出的消息列表"""
+        for decoder in self.decoders:
+            try:
+                messages = decoder(payload)
+            except Exception:
+                continue
+            if messages:
+                return messages
+        return []
+
+    def extract_products(self, message):
+        """递归查找消息中带商品标题字段的对象"""
+        if isinstance(message, list):
+            for item in message:
+                yield from self.extract_products(item)
+            return
+        if not isinstance(message, dict):
+            return
+
+        title = next(
+            (
+                message[name]
+                for name in self.title_fields
+                if isinstance(message.get(name), str)
+            ),
+            None,
+        )
+        if title:
+            goods_num = next(
+                (message[name] for name in self.goods_num_fields if message.get(name)),
+                None,
+            )
+            url = next(
+                (message[name] for name in self.url_fields if message.get(name)),
+                None,
+            )
+            yield {
+                "title": title,
+                "goods_num": str(goods_num) if goods_num is not None else None,
+                "url": url,
+            }
+
+        for value in message.values():
+            if isinstance(value, (dict, list)):
+                yield from self.extract_products(value)
+
+    def maintain(self, now):
+        """清理过期的去重记录，并定期报告推送帧数"""
+        if now - self.pruned_at >= self.dedup_seconds:
+            self.pruned_at = now
+            self.recent = {
+                key: seen_at
+                for key, seen_at in self.recent.items()
+                if now - seen_at < self.dedup_seconds
+            }
+        if now - self.reported_at >= self.report_interval:
+            logger.info(
+                f"📡 最近 {now - self.reported_at:.0f} 秒收到 {self.frame_count} 个推送帧，"
+                f"命中 {self.hit_count} 次"
+            )
+            self.reported_at = now
+            self.frame_count = 0
+            self.hit_count = 0
+
+    def on_frame(self, payload):
+        """收到推送帧：解码、匹配关键字并触发点击流程"""
+        self.frame_count += 1
+        now = time.time()
+        self.maintain(now)
+        for message in self.decode(payload):
+            for product in self.extract_products(message):
+                keyword = self.searcher.match_keyword(product["title"])
+                if not keyword:
+                    continue
+                key = product["goods_num"] or product["title"]
+                if now - self.recent.get(key, 0) < self.dedup_seconds:
+                    continue
+                self.recent[key] = now
+                self.hit_count += 1
+                logger.info(f"📡 推送命中: {product['title'][:100]}")
+                self.searcher.spawn(self.searcher.handle_push_match(keyword, product))
+
+
+class DetectionHistory:
+    """基于SQLite（WAL模式）的检测历史：记录商品出现、点击和各阶段耗时
+
+    写入先进入异步队列，由后台任务批量写库，不阻塞扫描。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sightings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            room TEXT NOT NULL,
+            keyword TEXT NOT NULL,
+            goods_num TEXT,
+            title TEXT,
+            source TEXT
+        );
+        CREATE TABLE IF NOT EXISTS clicks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            room TEXT NOT NULL,
+            keyword TEXT NOT NULL,
+            goods_num TEXT,
+            success INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS scans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            room TEXT NOT NULL,
+            keyword TEXT NOT NULL,
+            hit INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS stage_latencies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            room TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            duration_ms REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS overruns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            room TEXT NOT NULL,
+            stage TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS evidence (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            room TEXT NOT NULL,
+            keyword TEXT NOT NULL,
+            goods_num TEXT,
+            kind TEXT NOT NULL,
+            path TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sightings_goods ON sightings (goods_num, ts);
+        CREATE INDEX IF NOT EXISTS idx_sightings_keyword ON sightings (keyword, ts);
+        CREATE INDEX IF NOT EXISTS idx_sightings_room ON sightings (room, ts);
+        CREATE INDEX IF NOT EXISTS idx_sightings_ts ON sightings (ts);
+        CREATE INDEX IF NOT EXISTS idx_clicks_goods ON clicks (goods_num, ts);
+        CREATE INDEX IF NOT EXISTS idx_clicks_room ON clicks (room, ts);
+        CREATE INDEX IF NOT EXISTS idx_scans_keyword ON scans (keyword, room, ts);
+        CREATE INDEX IF NOT EXISTS idx_latencies_stage ON stage_latencies (stage, ts);
+        CREATE INDEX IF NOT EXISTS idx_latencies_room ON stage_latencies (room, ts);
+        CREATE INDEX IF NOT EXISTS idx_overruns_stage ON overruns (stage, ts);
+        CREATE INDEX IF NOT EXISTS idx_evidence_goods ON evidence (goods_num, ts);
+    """
+
+    INSERTS = {
+        "sightings": "INSERT INTO sightings (ts, room, keyword, goods_num, title, source) VALUES (?, ?, ?, ?, ?, ?)",
+        "clicks": "INSERT INTO clicks (ts, room, keyword, goods_num, success) VALUES (?, ?, ?, ?, ?)",
+        "scans": "INSERT INTO scans (ts, room, keyword, hit) VALUES (?, ?, ?, ?)",
+        "stage_latencies": "INSERT INTO stage_latencies (ts, room, stage, duration_ms) VALUES (?, ?, ?, ?)",
+        "overruns": "INSERT INTO overruns (ts, room, stage) VALUES (?, ?, ?)",
+        "evidence": "INSERT INTO evidence (ts, room, keyword, goods_num, kind, path) VALUES (?, ?, ?, ?, ?, ?)",
+    }
+
+    STOP = object()  # 写入队列的结束标记
+
+    def __init__(self, path, batch_size=100, flush_interval=1.0, queue_size=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.connection = None
+        self.lock = threading.Lock()  # 写库线程与关闭数据库互斥
+        self.queue = None
+        self.writer_task = None
+        self.dropped = 0
+
+    def open(self):
+        """打开数据库并创建表和索引"""
+        if self.connection is not None:
+            return
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+        self.connection.commit()
+
+    def close(self):
+        """关闭数据库（等待正在进行的批量写入完成）"""
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def start(self):
+        """启动后台批量写入任务"""
+        self.open()
+        if self.writer_task is None:
+            self.queue = asyncio.Queue(self.queue_size)
+            self.writer_task = asyncio.create_task(self.writer())
+
+    def enqueue(self, table, row):
+        """将一行写入请求放入队列，队列写满时丢弃并计数"""
+        if self.queue is None:
+            return
+        try:
+            self.queue.put_nowait((table, row))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"⚠️ 检测历史写入队列已满，已丢弃 {self.dropped} 条记录")
+
+    def record_sighting(self, detection, source="dom"):
+        """记录一次商品出现"""
+        self.enqueue(
+            "sightings",
+            (
+                detection.detected_at,
+                detection.room,
+                detection.keyword,
+                detection.goods_num,
+                detection.text,
+                source,
+            ),
+        )
+
+    def record_click(self, room, keyword, goods_num, success, ts=None):
+        """记录一次购买按钮点击（ts为点击时间，与evidence表对应）"""
+        self.enqueue(
+            "clicks", (ts or time.time(), room, keyword, goods_num, int(success))
+        )
+
+    def record_scan(self, room, keyword, hit):
+        """记录一次关键字搜索结果"""
+        self.enqueue("scans", (time.time(), room, keyword, int(hit)))
+
+    def record_latency(self, room, stage, seconds):
+        """记录一个阶段的耗时"""
+        self.enqueue("stage_latencies", (time.time(), room, stage, seconds * 1000))
+
+    def record_overrun(self, room, stage):
+        """记录一次超出时间预算的阶段"""
+        self.enqueue("overruns", (time.time(), room, stage))
+
+    def record_evidence(self, ts, room, keyword, goods_num, kind, path):
+        """记录一条点击证据文件（ts为点击时间，与clicks表对应）"""
+        self.enqueue("evidence", (ts, room, keyword, goods_num, kind, path))
+
+    def write_batch(self, batch):
+        """在线程中批量写入一批记录"""
+        rows_by_table = {}
+        for table, row in batch:
+            rows_by_table.setdefault(table, []).append(row)
+        with self.lock:
+            if self.connection is None:
+                return
+            with self.connection:
+                for table, rows in rows_by_table.items():
+                    self.connection.executemany(self.INSERTS[table], rows)
+
+    def drain(self, limit=None):
+        """取出队列中已有的记录"""
+        batch = []
+        while not self.queue.empty() and (limit is None or len(batch) < limit):
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def writer(self):
+        """后台任务：攒够一批或超过刷新间隔后写库，收到结束标记时写完当前批次后退出"""
+        stopping = False
+        while not stopping:
+            batch = []
+            item = await self.queue.get()
+            if item is self.STOP:
+                stopping = True
+            else:
+                batch.append(item)
+            deadline = time.monotonic() + self.flush_interval
+            while not stopping and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is self.STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            if batch:
+                try:
+                    await asyncio.to_thread(self.write_batch, batch)
+                except Exception as e:
+                    logger.error(f"❌ 写入检测历史失败: {e}")
+
+    async def flush(self):
+        """通知后台任务写完已排队的记录后退出，并等待其结束"""
+        if self.writer_task is not None:
+            await self.queue.put(self.STOP)
+            # 外层超时取消时不打断写入线程，后台任务仍会写完并退出
+            await asyncio.shield(self.writer_task)
+            self.writer_task = None
+        if self.queue is not None and self.connection is not None:
+            # 写入任务结束后才入队的记录
+            batch = self.drain()
+            if batch:
+                await asyncio.to_thread(self.write_batch, batch)
+        if self.dropped:
+            logger.warning(f"⚠️ 写入队列写满期间共丢弃 {self.dropped} 条检测历史")
+
+    def keyword_stats(self, room=None, days=30):
+        """各关键字的搜索/命中次数，用于初始化关键字调度"""
+        since = time.time() - days * 86400
+        query = "SELECT keyword, COUNT(*), SUM(hit) FROM scans WHERE ts >= ?"
+        params = [since]
+        if room:
+            query += " AND room = ?"
+            params.append(room)
+        query += " GROUP BY keyword"
+        return {
+            keyword: {"scans": scans, "hits": hits or 0}
+            for keyword, scans, hits in self.connection.execute(query, params)
+        }
+
+    def appearance_hours(self, room=None, days=30, limit=3):
+        """商品最常出现的几个小时（本地时间），用于生成发售窗口"""
+        since = time.time() - days * 86400
+        query = (
+            "SELECT CAST(strftime('%H', ts, 'unixepoch', 'localtime') AS INTEGER) AS hour,"
+            " COUNT(*) AS sightings FROM sightings WHERE ts >= ?"
+        )
+        params = [since]
+        if room:
+            query += " AND room = ?"
+            params.append(room)
+        query += " GROUP BY hour ORDER BY sightings DESC LIMIT ?"
+        params.append(limit)
+        return [hour for hour, _ in self.connection.execute(query, params)]
+
+    def appearance_patterns(self, goods_num=None, keyword=None, days=30):
+        """商品出现规律：首次/最近出现、出现天数、常见时段和平均在架时长"""
+        since = time.time() - days * 86400
+        conditions = ["ts >= ?"]
+        params = [since]
+        if goods_num:
+            conditions.append("goods_num = ?")
+            params.append(goods_num)
+        if keyword:
+            conditions.append("keyword = ?")
+            params.append(keyword)
+        where = " AND ".join(conditions)
+
+        # 按商品和日期聚合：当天首次出现到最后一次出现视为在架时长
+        rows = self.connection.execute(
+            f"""
+            SELECT COALESCE(goods_num, title) AS item, keyword,
+                   date(ts, 'unixepoch', 'localtime') AS day,
+                   MIN(ts), MAX(ts), COUNT(*)
+            FROM sightings WHERE {where}
+            GROUP BY item, keyword, day
+            """,
+            params,
+        ).fetchall()
+
+        patterns = {}
+        for item, item_keyword, day, first_ts, last_ts, count in rows:
+            pattern = patterns.setdefault(
+                item,
+                {
+                    "item": item,
+                    "keyword": item_keyword,
+                    "first_seen": first_ts,
+                    "last_seen": last_ts,
+                    "days": 0,
+                    "sightings": 0,
+                    "shelf_seconds": [],
+                    "hours": {},
+                },
+            )
+            pattern["first_seen"] = min(pattern["first_seen"], first_ts)
+            pattern["last_seen"] = max(pattern["last_seen"], last_ts)
+            pattern["days"] += 1
+            pattern["sightings"] += count
+            pattern["shelf_seconds"].append(last_ts - first_ts)
+            hour = datetime.fromtimestamp(first_ts).hour
+            pattern["hours"][hour] = pattern["hours"].get(hour, 0) + 1
+
+        for pattern in patterns.values():
+            shelf = pattern.pop("shelf_seconds")
+            pattern["avg_shelf_seconds"] = sum(shelf) / len(shelf)
+            pattern["common_hours"] = sorted(
+                pattern.pop("hours").items(), key=lambda item: -item[1]
+            )[:3]
+        return sorted(patterns.values(), key=lambda pattern: -pattern["last_seen"])
+
+    def latency_trends(self, stage=None, days=7):
+        """各阶段每日耗时统计：次数、平均、P50、P95、最大值（毫秒）"""
+        since = time.time() - days * 86400
+        query = (
+            "SELECT date(ts, 'unixepoch', 'localtime') AS day, stage, duration_ms"
+            " FROM stage_latencies WHERE ts >= ?"
+        )
+        params = [since]
+        if stage:
+            query += " AND stage = ?"
+            params.append(stage)
+
+        grouped = {}
+        for day, row_stage, duration in self.connection.execute(query, params):
+            grouped.setdefault((day, row_stage), []).append(duration)
+
+        trends = []
+        for (day, row_stage), durations in sorted(grouped.items()):
+            durations.sort()
+            trends.append(
+                {
+                    "day": day,
+                    "stage": row_stage,
+                    "count": len(durations),
+                    "avg_ms": sum(durations) / len(durations),
+                    "p50_ms": durations[len(durations) // 2],
+                    "p95_ms": durations[
+                        min(len(durations) - 1, int(len(durations) * 0.95))
+                    ],
+                    "max_ms": durations[-1],
+                }
+            )
+        return trends
+
+    def overrun_counts(self, stage=None, days=7):
+        """各阶段每日超出时间预算的次数"""
+        since = time.time() - days * 86400
+        query = (
+            "SELECT date(ts, 'unixepoch', 'localtime') AS day, stage, COUNT(*)"
+            " FROM overruns WHERE ts >= ?"
+        )
+        params = [since]
+        if stage:
+            query += " AND stage = ?"
+            params.append(stage)
+        query += " GROUP BY day, stage ORDER BY day, stage"
+        return [
+            {"day": day, "stage": row_stage, "count": count}
+            for day, row_stage, count in self.connection.execute(query, params)
+        ]
+
+
+class DetectionLedger:
+    """同机多实例共享的检测账本（SQLite + WAL）
+
+    各实例在处理商品前先为 (直播间, 商品编号) 申请租约，申请通过
+    BEGIN IMMEDIATE 事务串行化（SQLite文件锁即咨询锁），租约未过期时其它实例
+    不会重复提醒和点击；同时发布各自的商品出现记录供其它实例参考。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS leases (
+            room TEXT NOT NULL,
+            goods_num TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (room, goods_num)
+        );
+        CREATE TABLE IF NOT EXISTS sightings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            owner TEXT NOT NULL,
+            room TEXT NOT NULL,
+            keyword TEXT NOT NULL,
+            goods_num TEXT,
+            title TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_leases_expires ON leases (expires_at);
+        CREATE INDEX IF NOT EXISTS idx_ledger_sightings_ts ON sightings (ts);
+    """
+
+    def __init__(self, path, owner, lease_seconds=30, hold_seconds=300):
+        self.path = path
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.hold_seconds = hold_seconds
+        self.lock = threading.Lock()  # 同一连接在线程池中串行使用
+        self.connection = sqlite3.connect(
+            path, timeout=5, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+
+    def close(self):
+        """关闭账本（等待线程池中正在进行的操作完成，之后的操作直接忽略）"""
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def claim(self, room, goods_num):
+        """申请租约，成功返回True；其它实例持有未过期租约时返回False"""
+        now = time.time()
+        with self.lock:
+            if self.connection is None:
+                return True
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT owner, expires_at FROM leases WHERE room = ? AND goods_num = ?",
+                    (room, goods_num),
+                ).fetchone()
+                if row and row[0] != self.owner and row[1] > now:
+                    self.connection.execute("ROLLBACK")
+                    return False
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO leases (room, goods_num, owner, expires_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    (room, goods_num, self.owner, now + self.lease_seconds),
+                )
+                self.connection.execute("COMMIT")
+                return True
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def complete(self, room, goods_num):
+        """处理结束：把租约延长到去重保留期，避免其它实例随后重复处理"""
+        with self.lock:
+            if self.connection is None:
+                return
+            self.connection.execute(
+                "UPDATE leases SET expires_at = ? WHERE room = ? AND goods_num = ? AND owner = ?",
+                (time.time() + self.hold_seconds, room, goods_num, self.owner),
+            )
+
+    def release(self, room, goods_num):
+        """处理未成功：删除本实例的租约，其它实例可立即接手"""
+        with self.lock:
+            if self.connection is None:
+                return
+            self.connection.execute(
+                "DELETE FROM leases WHERE room = ? AND goods_num = ? AND owner = ?",
+                (room, goods_num, self.owner),
+            )
+
+    def publish_sighting(self, detection):
+        """发布一条商品出现记录"""
+        with self.lock:
+            if self.connection is None:
+                return
+            self.connection.execute(
+                "INSERT INTO sightings (ts, owner, room, keyword, goods_num, title)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    detection.detected_at,
+                    self.owner,
+                    detection.room,
+                    detection.keyword,
+                    detection.goods_num,
+                    detection.text,
+                ),
+            )
+
+    def peer_sightings(self, since):
+        """其它实例自since以来发布的商品出现记录"""
+        with self.lock:
+            if self.connection is None:
+                return []
+            return self.connection.execute(
+                "SELECT ts, owner, room, keyword, goods_num, title FROM sightings"
+                " WHERE ts > ? AND owner != ? ORDER BY ts",
+                (since, self.owner),
+            ).fetchall()
+
+    def prune(self, keep_seconds=86400):
+        """清理过期租约和旧的出现记录"""
+        now = time.time()
+        with self.lock:
+            if self.connection is None:
+                return
+            self.connection.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+            self.connection.execute(
+                "DELETE FROM sightings WHERE ts < ?", (now - keep_seconds,)
+            )
+
+
+class SessionProbe:
+    """快速检查登录状态：读取上下文Cookie的存在与过期时间，可选发送一次轻量请求"""
+
+    def __init__(self, session_config):
+        self.cookie_urls = session_config.get("cookie_urls", ["https://www.taobao.com"])
+        self.required_cookies = session_config.get(
+            "required_cookies", ["unb", "cookie2"]
+        )
+        self.expiry_margin = session_config.get("expiry_margin", 600)
+        self.probe_url = session_config.get("probe_url", "")
+        self.login_markers = session_config.get("login_markers", ["login.taobao.com"])
+        self.request_timeout = session_config.get("request_timeout", 3000)
+
+    async def check(self, context):
+        """返回 (是否有效, 说明, 耗时毫秒)"""
+        started = time.perf_counter()
+        healthy, reason = await self.check_cookies(context)
+        if healthy and self.probe_url:
+            healthy, reason = await self.check_request(context)
+        return healthy, reason, (time.perf_counter() - started) * 1000
+
+    async def check_cookies(self, context):
+        """检查登录Cookie是否存在且未临近过期"""
+        cookies = {
+            cookie["name"]: cookie for cookie in await context.cookies(self.cookie_urls)
+        }
+        now = time.time()
+        soonest = None
+        for name in self.required_cookies:
+            cookie = cookies.get(name)
+            if cookie is None or not cookie.get("value"):
+                return False, f"缺少登录Cookie: {name}"
+            expires = cookie.get("expires", -1)
+            if expires != -1:
+                if expires <= now + self.expiry_margin:
+                    return False, f"登录Cookie即将过期: {name}"
+                soonest = expires if soonest is None else min(soonest, expires)
+
+        if soonest is None:
+            return True, "登录Cookie有效（会话Cookie）"
+        return True, f"登录Cookie有效，剩余 {(soonest - now) / 3600:.1f} 小时"
+
+    async def check_request(self, context):
+        """发送一次不跟随跳转的请求，被重定向到登录页即视为已登出"""
+        try:
+            response = await context.request.get(
+                self.probe_url, max_redirects=0, timeout=self.request_timeout
+            )
+        except Exception as e:
+            # 网络问题不等同于登出，只记录不阻断
+            return True, f"探测请求失败，仅依据Cookie判断: {e}"
+        location = response.headers.get("location", "")
+        if any(
+            marker in location or marker in response.url
+            for marker in self.login_markers
+        ):
+            return False, "探测请求被重定向到登录页"
+        if response.status in (401, 403):
+            return False, f"探测请求返回 {response.status}"
+        return True, f"探测请求正常 ({response.status})"
+
+
+class ProfileCompactor:
+    """清理持久化用户目录中无限增长的缓存，保留登录所需的Cookie和本地存储"""
+
+    # 相对于用户目录的可清理路径（不包含Cookies、Local Storage、Preferences等）
+    DEFAULT_PRUNE_PATHS = [
+        "Default/Cache",
+        "Default/Code Cache",
+        "Default/GPUCache",
+        "Default/DawnCache",
+        "Default/DawnGraphiteCache",
+        "Default/Service Worker/CacheStorage",
+        "Default/Service Worker/ScriptCache",
+        "Default/IndexedDB",
+        "Default/blob_storage",
+        "GrShaderCache",
+        "GraphiteDawnCache",
+        "ShaderCache",
+        "component_crx_cache",
+    ]
+
+    def __init__(self, user_data_dir, profile_config):
+        self.user_data_dir = user_data_dir
+        self.prune_paths = profile_config.get("prune_paths", self.DEFAULT_PRUNE_PATHS)
+        self.size_limit = profile_config.get("size_limit_mb", 500) * 1024 * 1024
+        self.stats_file = os.path.join(user_data_dir, "launch_stats.json")
+
+    @staticmethod
+    def directory_size(path):
+        """目录总字节数"""
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    continue
+        return total
+
+    def needs_compaction(self):
+        """用户目录是否超过大小上限"""
+        return self.directory_size(self.user_data_dir) > self.size_limit
+
+    def compact(self):
+        """删除缓存目录（需在浏览器关闭时执行），返回 (压缩前字节数, 压缩后字节数)"""
+        before = self.directory_size(self.user_data_dir)
+        for relative_path in self.prune_paths:
+            path = os.path.join(self.user_data_dir, *relative_path.split("/"))
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.isfile(path):
+                os.remove(path)
+        return before, self.directory_size(self.user_data_dir)
+
+    def last_launch_seconds(self):
+        """上次记录的浏览器启动耗时"""
+        try:
+            with open(self.stats_file, "r", encoding="utf-8") as f:
+                return json.load(f).get("launch_seconds")
+        except (OSError, ValueError):
+            return None
+
+    def save_launch_seconds(self, seconds):
+        """记录本次浏览器启动耗时"""
+        try:
+            with open(self.stats_file, "w", encoding="utf-8") as f:
+                json.dump({"launch_seconds": seconds, "recorded_at": time.time()}, f)
+        except OSError as e:
+            logger.warning(f"⚠️ 记录启动耗时失败: {e}")
+
+
+class CycleTracer:
+    """慢检查追踪：每轮检查都开启Playwright tracing，只保留超时或出错的那一轮
+
+    追踪文件按时间轮转，最多保留 max_traces 个。
+    """
+
+    def __init__(self, tracing_config):
+        self.enabled = tracing_config.get("enabled", False)
+        self.threshold = tracing_config.get("threshold_seconds", 30)
+        self.max_traces = tracing_config.get("max_traces", 10)
+        self.directory = os.path.join(
+            os.getcwd(), tracing_config.get("directory", "traces")
+        )
+        self.active = False
+
+    async def start(self, context):
+        """开始记录本轮检查"""
+        if not self.enabled:
+            return
+        try:
+            await context.tracing.start(screenshots=False, snapshots=True)
+            self.active = True
+        except Exception as e:
+            logger.warning(f"⚠️ 启动tracing失败: {e}")
+
+    async def stop(self, context, check_count, elapsed, failed):
+        """结束记录：慢检查或出错时保存追踪文件，否则丢弃"""
+        if not self.active:
+            return None
+        self.active = False
+        try:
+            if not failed and elapsed <= self.threshold:
+                await context.tracing.stop()
+                return None
+
+            os.makedirs(self.directory, exist_ok=True)
+            reason = "error" if failed else f"{elapsed:.1f}s"
+            path = os.path.join(
+                self.directory,
+                f"cycle-{datetime.now():%Y%m%d-%H%M%S}-{check_count}-{reason}.zip",
+            )
+            await context.tracing.stop(path=path)
+            await asyncio.to_thread(self.rotate)
+            logger.info(f"🧾 已保存慢检查追踪: {path}")
+            return path
+        except Exception as e:
+            logger.warning(f"⚠️ 保存tracing失败: {e}")
+            return None
+
+    def rotate(self):
+        """只保留最新的 max_traces 个追踪文件"""
+        traces = sorted(
+            (
+                os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if name.startswith("cycle-") and name.endswith(".zip")
+            ),
+            key=os.path.getmtime,
+        )
+        for path in traces[: max(0, len(traces) - self.max_traces)]:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+
+class EvidenceRecorder:
+    """点击证据采集：购买按钮点击发出后，通过CDP截图或抓取DOM片段
+
+    采集在后台任务中进行，不占用点击路径；解码和写盘交给线程池，
+    待写入队列有上限，写满时丢弃最旧的一条。每条证据记录到检测历史，
+    与直播间、关键字和商品编号关联。
+    """
+
+    def __init__(self, evidence_config, history=None):
+        self.enabled = evidence_config.get("enabled", False)
+        self.mode = evidence_config.get("mode", "screenshot")  # screenshot | dom
+        self.quality = evidence_config.get("quality", 60)
+        self.dom_selector = evidence_config.get("dom_selector", "body")
+        self.dom_max_chars = evidence_config.get("dom_max_chars", 200000)
+        self.directory = os.path.join(
+            os.getcwd(), evidence_config.get("directory", "evidence")
+        )
+        self.queue_size = evidence_config.get("queue_size", 20)
+        self.workers = evidence_config.get("workers", 2)
+        self.history = history
+        self.queue = None
+        self.executor = None
+        self.writer_tasks = []
+        self.capture_tasks = set()
+        self.dropped = 0
+
+    def start(self):
+        """启动线程池和写入任务"""
+        if not self.enabled or self.queue is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.queue = asyncio.Queue(self.queue_size)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="evidence"
+        )
+        self.writer_tasks = [
+            asyncio.create_task(self.writer()) for _ in range(self.workers)
+        ]
+
+    def capture(self, page, room, keyword, goods_num, clicked_at):
+        """登记一次采集（同步返回，不等待截图）"""
+        if self.queue is None:
+            return
+        task = asyncio.create_task(
+            self.collect(page, room, keyword, goods_num, clicked_at)
+        )
+        self.capture_tasks.add(task)
+        task.add_done_callback(self.capture_tasks.discard)
+
+    async def collect(self, page, room, keyword, goods_num, clicked_at):
+        """从页面取出原始数据放入写入队列"""
+        try:
+            if self.mode == "dom":
+                payload = await page.evaluate(
+                    "([selector, limit]) => {"
+                    " const node = document.querySelector(selector);"
+                    " return node ? node.outerHTML.slice(0, limit) : '';"
+                    "}",
+                    [self.dom_selector, self.dom_max_chars],
+                )
+            else:
+                session = await page.context.new_cdp_session(page)
+                try:
+                    result = await session.send(
+                        "Page.captureScreenshot",
+                        {"format": "jpeg", "quality": self.quality},
+                    )
+                finally:
+                    await session.detach()
+                payload = result["data"]
+        except Exception as e:
+            logger.warning(f"⚠️ 采集点击证据失败: {e}")
+            return
+
+        item = (clicked_at, room, keyword, goods_num, self.mode, payload)
+        if self.queue.full():
+            # 写入跟不上时丢弃最旧的证据，保证最新的点击有记录
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.dropped += 1
+        self.queue.put_nowait(item)
+
+    def write(self, item):
+        """在线程池中解码并写盘，返回文件路径"""
+        clicked_at, room, keyword, goods_num, kind, payload = item
+        stamp = datetime.fromtimestamp(clicked_at).strftime("%Y%m%d-%H%M%S-%f")
+        if kind == "dom":
+            path = os.path.join(self.directory, f"{stamp}-{goods_num or 'na'}.html")
+            data = payload.encode("utf-8")
+        else:
+            path = os.path.join(self.directory, f"{stamp}-{goods_num or 'na'}.jpg")
+            data = base64.b64decode(payload)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    async def writer(self):
+        """后台任务：把队列中的证据交给线程池写盘并登记到检测历史"""
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            try:
+                path = await loop.run_in_executor(self.executor, self.write, item)
+                clicked_at, room, keyword, goods_num, kind, _ = item
+                if self.history:
+                    self.history.record_evidence(
+                        clicked_at, room, keyword, goods_num, kind, path
+                    )
+                logger.info(f"📸 已保存点击证据: {path}")
+            except Exception as e:
+                logger.error(f"❌ 保存点击证据失败: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def wait_captures(self, timeout=5):
+        """等待已登记的采集从页面取完数据（关闭页面前调用）"""
+        if self.capture_tasks:
+            await asyncio.wait(list(self.capture_tasks), timeout=timeout)
+
+    async def close(self, timeout=5):
+        """等待未完成的采集和写入，然后关闭线程池"""
+        if self.queue is None:
+            return
+        try:
+            if self.capture_tasks:
+                await asyncio.wait(list(self.capture_tasks), timeout=timeout)
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ 仍有 {self.queue.qsize()} 条点击证据未保存")
+        for task in self.writer_tasks:
+            task.cancel()
+        await asyncio.gather(*self.writer_tasks, return_exceptions=True)
+        self.writer_tasks = []
+        self.executor.shutdown(wait=False)
+        self.queue = None
+        if self.dropped:
+            logger.warning(f"⚠️ 写入繁忙期间丢弃了 {self.dropped} 条点击证据")
+
+
+class LoopLagMonitor:
+    """事件循环延迟监控
+
+    后台协程按固定间隔休眠并测量实际唤醒延迟；独立的看门狗线程检查协程心跳，
+    一旦事件循环被阻塞超过阈值，就抓取事件循环线程当前的调用栈并记录日志，
+    从而定位阻塞事件循环的同步调用。
+    """
+
+    instances = {}  # id(事件循环) -> 监控器，同一事件循环只运行一个
+
+    def __init__(self, lag_config):
+        self.interval = lag_config.get("interval", 0.1)
+        self.threshold = lag_config.get("threshold", 0.2)
+        self.report_interval = lag_config.get("report_interval", 60)
+        self.debug = lag_config.get("debug", False)
+        self.samples = deque(maxlen=lag_config.get("window", 3000))
+        self.heartbeat = time.monotonic()
+        self.loop = None
+        self.loop_thread_id = None
+        self.task = None
+        self.watchdog = None
+        self.stopped = threading.Event()
+        self.reporters = []  # 定期接收延迟分位数的回调
+
+    @classmethod
+    def for_running_loop(cls, lag_config):
+        """获取（必要时创建并启动）当前事件循环的监控器"""
+        loop = asyncio.get_running_loop()
+        monitor = cls.instances.get(id(loop))
+        if monitor is None:
+            monitor = cls(lag_config)
+            monitor.start(loop)
+            cls.instances[id(loop)] = monitor
+        return monitor
+
+    def start(self, loop):
+        """启动测量协程和看门狗线程"""
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        if self.debug:
+            # asyncio自带的慢回调报告
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.threshold
+        self.task = loop.create_task(self.measure())
+        self.watchdog = threading.Thread(
+            target=self.watch_heartbeat, name="loop-lag-watchdog", daemon=True
+        )
+        self.watchdog.start()
+        logger.info(
+            f"🩺 事件循环延迟监控已启动 (阈值 {self.threshold * 1000:.0f} ms"
+            f"{'，debug模式' if self.debug else ''})"
+        )
+
+    def stop(self):
+        """停止监控"""
+        self.stopped.set()
+        if self.task:
+            self.task.cancel()
+        if self.loop is not None:
+            self.instances.pop(id(self.loop), None)
+
+    async def measure(self):
+        """测量每次定时唤醒的延迟"""
+        last_report = time.monotonic()
+        while True:
+            expected = self.loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, self.loop.time() - expected)
+            self.samples.append(lag)
+            self.heartbeat = time.monotonic()
+
+            if self.heartbeat - last_report >= self.report_interval:
+                last_report = self.heartbeat
+                self.report()
+
+    def percentiles(self):
+        """延迟分位数（毫秒）"""
+        if not self.samples:
+            return {}
+        ordered = sorted(self.samples)
+
+        def pick(ratio):
+            return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))] * 1000
+
+        return {
+            "p50": pick(0.5),
+            "p95": pick(0.95),
+            "p99": pick(0.99),
+            "max": ordered[-1] * 1000,
+        }
+
+    def report(self):
+        """输出延迟分位数并交给各回调"""
+        metrics = self.percentiles()
+        if not metrics:
+            return
+        logger.info(
+            "🩺 事件循环延迟 "
+            + " ".join(f"{name}={value:.1f}ms" for name, value in metrics.items())
+        )
+        for reporter in self.reporters:
+            try:
+                reporter(metrics)
+            except Exception as e:
+                logger.error(f"❌ 上报事件循环延迟失败: {e}")
+
+    def watch_heartbeat(self):
+        """看门狗线程：心跳超时说明事件循环被阻塞，记录阻塞位置的调用栈"""
+        reported_heartbeat = None
+        while not self.stopped.wait(self.threshold / 2):
+            heartbeat = self.heartbeat
+            stalled = time.monotonic() - heartbeat
+            if (
+                stalled < self.threshold + self.interval
+                or heartbeat == reported_heartbeat
+            ):
+                continue
+            reported_heartbeat = heartbeat  # 每次阻塞只记录一次
+
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            try:
+                task = asyncio.current_task(self.loop)
+            except RuntimeError:
+                task = None
+            stack = "".join(traceback.format_stack(frame, limit=15))
+            logger.warning(
+                f"🐢 事件循环已阻塞 {stalled * 1000:.0f} ms"
+                f" (任务: {task.get_name() if task else '未知'})，调用栈:\n{stack}"
+            )
+
+
+class CycleProfiler:
+    """按信号开启的运行时性能分析
+
+    收到信号（默认SIGUSR1，仅Linux/macOS）后，从下一轮检查开始用cProfile
+    分析接下来的 N 轮检查，结束后把 .prof 文件和按耗时排序的函数汇总写入磁盘，
+    整个过程不中断持续监控。同一事件循环共享一个分析器。
+    """
+
+    instances = {}  # id(事件循环) -> 分析器
+
+    def __init__(self, profiler_config):
+        self.cycles = profiler_config.get("cycles", 5)
+        self.signal_name = profiler_config.get("signal", "SIGUSR1")
+        self.top = profiler_config.get("top", 40)
+        self.sort = profiler_config.get("sort", "cumulative")
+        self.directory = os.path.join(
+            os.getcwd(), profiler_config.get("directory", "profiles")
+        )
+        self.loop = None
+        self.signal = None
+        self.requested = False
+        self.profile = None
+        self.remaining = 0
+        self.users = 0  # 共享该分析器的监控实例数
+
+    @classmethod
+    def for_running_loop(cls, profiler_config):
+        """获取（必要时创建并安装信号处理）当前事件循环的分析器"""
+        loop = asyncio.get_running_loop()
+        profiler = cls.instances.get(id(loop))
+        if profiler is None:
+            profiler = cls(profiler_config)
+            if not profiler.install(loop):
+                return None
+            cls.instances[id(loop)] = profiler
+        profiler.users += 1
+        return profiler
+
+    def install(self, loop):
+        """在事件循环上注册信号处理，平台不支持时返回False"""
+        sig = getattr(signal, self.signal_name, None)
+        if sig is None or sys.platform == "win32":
+            logger.info(f"⚠️ 当前平台不支持 {self.signal_name}，跳过性能分析信号")
+            return False
+        try:
+            loop.add_signal_handler(sig, self.request)
+        except (NotImplementedError, RuntimeError, ValueError) as e:
+            logger.warning(f"⚠️ 注册性能分析信号失败: {e}")
+            return False
+        self.loop = loop
+        self.signal = sig
+        logger.info(
+            f"🔬 发送 {self.signal_name} (kill -{self.signal_name[3:]} {os.getpid()}) "
+            f"可分析接下来 {self.cycles} 轮检查"
+        )
+        return True
+
+    def request(self):
+        """信号处理：请求从下一轮检查开始分析"""
+        if self.requested or self.profile is not None:
+            logger.info("🔬 性能分析已在进行中")
+            return
+        self.requested = True
+        logger.info(f"🔬 收到 {self.signal_name}，将分析接下来 {self.cycles} 轮检查")
+
+    def cycle_started(self):
+        """一轮检查开始：有请求时开启分析"""
+        if not self.requested or self.profile is not None:
+            return
+        self.requested = False
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # 同一线程已有其它分析器在运行
+            logger.warning(f"⚠️ 无法开启性能分析: {e}")
+            return
+        self.profile = profile
+        self.remaining = self.cycles
+
+    async def cycle_finished(self):
+        """一轮检查结束：分析够 N 轮后写入结果"""
+        if self.profile is None:
+            return
+        self.remaining -= 1
+        if self.remaining <= 0:
+            await self.finish()
+
+    async def finish(self):
+        """停止分析并在线程中写入 .prof 和汇总文件"""
+        if self.profile is None:
+            return
+        profile, self.profile = self.profile, None
+        profile.disable()
+        try:
+            prof_path, summary_path = await asyncio.to_thread(self.dump, profile)
+            logger.info(f"🔬 性能分析已保存: {prof_path}，汇总: {summary_path}")
+        except Exception as e:
+            logger.error(f"❌ 保存性能分析失败: {e}")
+
+    def dump(self, profile):
+        """写入原始分析数据和前 top 个函数的汇总"""
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(
+            self.directory, f"profile-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+        )
+        profile.dump_stats(f"{base}.prof")
+        with open(f"{base}.txt", "w", encoding="utf-8") as f:
+            pstats.Stats(profile, stream=f).sort_stats(self.sort).print_stats(self.top)
+        return f"{base}.prof", f"{base}.txt"
+
+    async def stop(self):
+        """最后一个使用者退出时写入未完成的分析并移除信号处理"""
+        self.users -= 1
+        if self.users > 0:
+            return
+        await self.finish()
+        if self.loop is not None:
+            self.loop.remove_signal_handler(self.signal)
+            self.instances.pop(id(self.loop), None)
+            self.loop = None
+
+
+class Dashboard:
+    """终端实时面板：直播间、关键字、最近命中、各阶段耗时、浏览器内存和事件循环延迟
+
+    检测代码只更新内存中的状态；独立的渲染任务按限定帧率生成画面，
+    只重绘发生变化的行（ANSI光标定位），由后台线程写入终端，
+    终端输出不会阻塞事件循环。面板开启期间日志改写到文件。
+    同一事件循环共享一个面板。
+    """
+
+    instances = {}  # id(事件循环) -> 面板
+
+    def __init__(self, dashboard_config):
+        self.refresh_interval = 1 / max(1, dashboard_config.get("refresh_rate", 4))
+        self.recent_hits = dashboard_config.get("recent_hits", 8)
+        self.log_file = dashboard_config.get("log_file", "monitor.log")
+        self.rooms = {}  # 直播间 -> 状态
+        self.keywords = {}  # (直播间, 关键字) -> [搜索次数, 命中次数, 最近命中时间]
+        self.stages = {}  # 阶段 -> 耗时统计（毫秒）
+        self.hits = deque(maxlen=self.recent_hits)
+        self.lag_monitor = None
+        self.started_at = time.time()
+        self.loop = None
+        self.render_task = None
+        self.output = queue.Queue(maxsize=4)
+        self.output_thread = None
+        self.previous = []  # 上一帧各行内容
+        self.width = 0
+        self.console_handlers = []
+        self.file_handler = None
+        self.users = 0
+
+    @classmethod
+    def for_running_loop(cls, dashboard_config):
+        """获取（必要时创建并启动）当前事件循环的面板"""
+        loop = asyncio.get_running_loop()
+        dashboard = cls.instances.get(id(loop))
+        if dashboard is None:
+            dashboard = cls(dashboard_config)
+            dashboard.start(loop)
+            cls.instances[id(loop)] = dashboard
+        dashboard.users += 1
+        return dashboard
+
+    @staticmethod
+    def room_label(room):
+        """直播间的简短名称（优先使用liveId）"""
+        for part in room.replace("?", "&").split("&"):
+            if part.startswith("liveId="):
+                return part
+        return room[-30:]
+
+    def start(self, loop):
+        """日志改写到文件，切换到备用屏幕并启动渲染任务和输出线程"""
+        self.loop = loop
+        root = logging.getLogger()
+        self.console_handlers = [
+            handler
+            for handler in root.handlers
+            if isinstance(handler, logging.StreamHandler)
+            and not isinstance(handler, logging.FileHandler)
+        ]
+        self.file_handler = logging.FileHandler(self.log_file, encoding="utf-8")
+        if self.console_handlers:
+            self.file_handler.setFormatter(self.console_handlers[0].formatter)
+        root.addHandler(self.file_handler)
+        for handler in self.console_handlers:
+            root.removeHandler(handler)
+        logger.info("📺 终端面板已启动，日志写入文件")
+
+        self.output_thread = threading.Thread(
+            target=self.write_frames, name="dashboard-output", daemon=True
+        )
+        self.output_thread.start()
+        self.output.put("\x1b[?1049h\x1b[?25l\x1b[2J")
+        self.render_task = loop.create_task(self.render_loop())
+
+    def stop(self):
+        """最后一个使用者退出时恢复终端和日志输出"""
+        self.users -= 1
+        if self.users > 0:
+            return
+        if self.render_task:
+            self.render_task.cancel()
+        self.output.put("\x1b[?25h\x1b[?1049l")
+        self.output.put(None)
+        if self.output_thread:
+            self.output_thread.join(timeout=2)
+
+        root = logging.getLogger()
+        for handler in self.console_handlers:
+            root.addHandler(handler)
+        if self.file_handler:
+            root.removeHandler(self.file_handler)
+            self.file_handler.close()
+        if self.loop is not None:
+            self.instances.pop(id(self.loop), None)
+        logger.info(f"📺 终端面板已关闭，运行日志见 {self.log_file}")
+
+    def update_room(self, room, **fields):
+        """更新直播间状态（阶段、检查次数、内存等）"""
+        self.rooms.setdefault(room, {}).update(fields)
+
+    def record_scan(self, room, keyword, hit):
+        """记录一次关键字搜索"""
+        stats = self.keywords.setdefault((room, keyword), [0, 0, None])
+        stats[0] += 1
+        if hit:
+            stats[1] += 1
+            stats[2] = time.time()
+
+    def record_stage(self, stage, seconds):
+        """记录一个阶段的耗时"""
+        ms = seconds * 1000
+        stats = self.stages.setdefault(
+            stage, {"last": 0.0, "avg": ms, "max": 0.0, "count": 0, "overruns": 0}
+        )
+        stats["last"] = ms
+        stats["avg"] = stats["avg"] * 0.8 + ms * 0.2 if stats["count"] else ms
+        stats["max"] = max(stats["max"], ms)
+        stats["count"] += 1
+
+    def record_overrun(self, stage):
+        """记录一次超出时间预算的阶段"""
+        stats = self.stages.setdefault(
+            stage, {"last": 0.0, "avg": 0.0, "max": 0.0, "count": 0, "overruns": 0}
+        )
+        stats["overruns"] += 1
+
+    def record_hit(self, detection):
+        """记录一次商品命中"""
+        self.hits.appendleft(detection)
+
+    @staticmethod
+    def cell(value, width, right=False):
+        """按终端显示宽度（中文占两列）截断并补齐"""
+        text = str(value)
+        shown, used = "", 0
+        for char in text:
+            char_width = 2 if unicodedata.east_asian_width(char) in "WF" else 1
+            if used + char_width > width:
+                break
+            shown += char
+            used += char_width
+        padding = " " * (width - used)
+        return padding + shown if right else shown + padding
+
+    def build_lines(self):
+        """根据当前状态生成画面的各行"""
+        cell = self.cell
+        now = time.time()
+        lag = self.lag_monitor.percentiles() if self.lag_monitor else {}
+        lag_text = (
+            f"p50 {lag['p50']:.1f} ms  p99 {lag['p99']:.1f} ms  max {lag['max']:.0f} ms"
+            if lag
+            else "-"
+        )
+        lines = [
+            f"🎭 淘宝直播间监控   {datetime.now():%H:%M:%S}   "
+            f"已运行 {timedelta(seconds=int(now - self.started_at))}",
+            f"🩺 事件循环延迟: {lag_text}",
+            "",
+            cell("直播间", 28)
+            + cell("状态", 16)
+            + cell("检查", 8, True)
+            + cell("上轮耗时", 10, True)
+            + cell("JS堆", 10, True)
+            + cell("节点", 8, True),
+        ]
+        for room, state in self.rooms.items():
+            heap = state.get("heap_mb")
+            lines.append(
+                cell(self.room_label(room), 28)
+                + cell(state.get("status", "-"), 16)
+                + cell(state.get("checks", 0), 8, True)
+                + cell(f"{state.get('cycle_seconds', 0):.1f}s", 10, True)
+                + cell(f"{heap:.1f}MB" if heap is not None else "-", 10, True)
+                + cell(state.get("nodes", "-"), 8, True)
+            )
+
+        lines += [
+            "",
+            cell("关键字", 32)
+            + cell("搜索", 8, True)
+            + cell("命中", 8, True)
+            + cell("最近命中", 12, True),
+        ]
+        for (room, keyword), (scans, hits, last_hit) in self.keywords.items():
+            label = keyword if len(self.rooms) <= 1 else f"{keyword} @{room[-8:]}"
+            lines.append(
+                cell(label, 32)
+                + cell(scans, 8, True)
+                + cell(hits, 8, True)
+                + cell(
+                    f"{datetime.fromtimestamp(last_hit):%H:%M:%S}" if last_hit else "-",
+                    12,
+                    True,
+                )
+            )
+
+        lines += [
+            "",
+            cell("阶段耗时(ms)", 32)
+            + cell("最近", 8, True)
+            + cell("平均", 8, True)
+            + cell("最大", 8, True)
+            + cell("次数", 8, True)
+            + cell("超时", 8, True),
+        ]
+        for stage, stats in sorted(self.stages.items()):
+            if stage.startswith("loop_lag_"):
+                continue
+            lines.append(
+                cell(stage, 32)
+                + cell(f"{stats['last']:.0f}", 8, True)
+                + cell(f"{stats['avg']:.0f}", 8, True)
+                + cell(f"{stats['max']:.0f}", 8, True)
+                + cell(stats["count"], 8, True)
+                + cell(stats["overruns"], 8, True)
+            )
+
+        lines += ["", "🎯 最近命中"]
+        for detection in self.hits:
+            lines.append(
+                f"  {datetime.fromtimestamp(detection.detected_at):%H:%M:%S}  "
+                f"{detection.keyword}  {detection.goods_num or '-'}  "
+                f"{' '.join(detection.text.split())[:60]}"
+            )
+        return lines
+
+    def render(self):
+        """与上一帧比较，只生成变化行的ANSI重绘指令"""
+        width = shutil.get_terminal_size().columns
+        parts = []
+        if width != self.width:
+            # 终端尺寸变化时整屏重绘
+            self.width = width
+            self.previous = []
+            parts.append("\x1b[2J")
+        lines = [self.cell(line, width).rstrip() for line in self.build_lines()]
+        for row, line in enumerate(lines):
+            if row >= len(self.previous) or self.previous[row] != line:
+                parts.append(f"\x1b[{row + 1};1H{line}\x1b[K")
+        if len(self.previous) > len(lines):
+            parts.append(f"\x1b[{len(lines) + 1};1H\x1b[J")
+        self.previous = lines
+        return "".join(parts)
+
+    async def render_loop(self):
+        """渲染任务：按限定帧率生成画面交给输出线程"""
+        while True:
+            try:
+                frame = self.render()
+                if frame:
+                    try:
+                        self.output.put_nowait(frame)
+                    except queue.Full:
+                        # 终端输出跟不上：丢弃本帧，下一帧整屏重绘
+                        self.width = 0
+            except Exception as e:
+                logger.error(f"❌ 面板渲染失败: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def write_frames(self):
+        """输出线程：把画面写入终端"""
+        while True:
+            frame = self.output.get()
+            if frame is None:
+                break
+            try:
+                sys.stdout.write(frame)
+                sys.stdout.flush()
+            except Exception:
+                continue
+
+
+class DeadlineExceeded(Exception):
+    """阶段超出检查时间预算"""
+
+    def __init__(self, stage):
+        super().__init__(f"阶段 {stage} 超出检查时间预算")
+        self.stage = stage
+
+
+class CycleDeadline:
+    """一轮检查的时间预算，按份额分给各个阶段
+
+    各阶段用 timeout_ms() 把Playwright超时限制在剩余预算内，
+    用 run() 包装没有超时参数的等待；超时的阶段记录在 overruns 中。
+    budget 为 None 时不限时。
+    """
+
+    def __init__(self, budget=None, overruns=None):
+        self.expires_at = None if budget is None else time.monotonic() + budget
+        self.overruns = overruns if overruns is not None else []
+
+    def remaining(self):
+        """剩余秒数"""
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        """预算是否已用完"""
+        return self.remaining() <= 0
+
+    def share(self, fraction):
+        """分出剩余预算的一部分给子阶段（共享超时记录）"""
+        if self.expires_at is None:
+            return CycleDeadline(None, self.overruns)
+        return CycleDeadline(self.remaining() * fraction, self.overruns)
+
+    def timeout_ms(self, default_ms):
+        """不超过剩余预算的Playwright超时（毫秒）"""
+        if self.expires_at is None:
+            return default_ms
+        return max(1, min(default_ms, self.remaining() * 1000))
+
+    def overrun(self, stage):
+        """记录超时阶段并抛出DeadlineExceeded"""
+        self.overruns.append(stage)
+        raise DeadlineExceeded(stage)
+
+    def check(self, stage):
+        """预算已用完时按超时处理"""
+        if self.expired:
+            self.overrun(stage)
+
+    async def run(self, stage, awaitable):
+        """在剩余预算内等待awaitable，超时则取消并记录"""
+        if self.expires_at is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            self.overrun(stage)
+
+
+# 在页面内观察购买按钮状态：按钮已可购买时立即返回；否则用MutationObserver和
+# requestAnimationFrame检查，直到状态变为可购买、按钮被替换或超时才返回Python
+BUY_BUTTON_WATCH_SCRIPT = """
+(button, options) => new Promise((resolve) => {
+    const blockedPattern = new RegExp(options.disabledClassPattern, "i");
+    const readState = () => {
+        const text = (button.textContent || "").trim();
+        const className = typeof button.className === "string" ? button.className : "";
+        const disabled =
+            button.disabled === true ||
+            button.getAttribute("aria-disabled") === "true" ||
+            blockedPattern.test(className) ||
+            options.disabledTexts.some((blocked) => text.includes(blocked));
+        return { text, className, disabled, connected: button.isConnected };
+    };
+
+    const initial = readState();
+    if (!initial.disabled) {
+        resolve({ ...initial, ready: true, changed: false });
+        return;
+    }
+
+    let done = false;
+    let frame = 0;
+    let observer = null;
+    let timer = 0;
+    const finish = (state, changed) => {
+        if (done) return;
+        done = true;
+        if (observer) observer.disconnect();
+        cancelAnimationFrame(frame);
+        clearTimeout(timer);
+        resolve({ ...state, ready: !state.disabled && state.connected, changed });
+    };
+    const check = () => {
+        const state = readState();
+        if (!state.disabled || !state.connected) finish(state, true);
+    };
+
+    observer = new MutationObserver(check);
+    observer.observe(button.parentElement || button, {
+        attributes: true,
+        childList: true,
+        subtree: true,
+        characterData: true,
+    });
+    const tick = () => {
+        check();
+        if (!done) frame = requestAnimationFrame(tick);
+    };
+    frame = requestAnimationFrame(tick);
+    timer = setTimeout(() => finish(readState(), false), options.timeout);
+});
+"""
+
+
 class TaobaoLiveSearcher:
-    def __init__(self, config_file="config.yaml"):
-        """初始化搜索器"""
+    def __init__(
+        self,
+        config_file="config.yaml",
+        target_url=None,
+        storage_state=None,
+        detection_queue=None,
+        shard_id=None,
+    ):
+        """初始化搜索器
+
+        分片模式下由协调进程传入 target_url / storage_state / detection_queue，
+        此时浏览器不使用持久化目录，而是从登录状态快照启动。
+        """
         self.browser = None
         self.context = None
         self.page = None
         self.playwright = None
 
         # 加载配置文件
+        self.config_file = config_file
         self.config = self.load_config(config_file)
 
         self.user_data_dir = os.path.join(
             os.getcwd(), self.config["browser"]["user_data_dir"]
         )
-        self.target_url = self.config["target_url"]
-        self.search_keywords = self.config["search_keywords"]
+        self.target_url = target_url or self.config["target_url"]
+        self.storage_state = storage_state  # 登录状态快照文件路径
+        self.detection_queue = detection_queue  # 跨进程上报检测结果的队列
+        self.shard_id = shard_id
+        # 关键字可以是字符串，也可以是带 priority / weight 的字典
+        self.search_keywords = [
+            entry if isinstance(entry, str) else entry["keyword"]
+            for entry in self.config["search_keywords"]
+        ]
+        self.keyword_planner = KeywordPlanner(
+            self.config["search_keywords"],
+            self.config["monitoring"].get("keyword_scheduling"),
+        )
         self.is_running = True  # 控制循环运行
         self.check_count = 0  # 检查次数计数器
+        self.subscribers = []  # watch() 的检测事件订阅者
+        self.scan_task = None  # 后台扫描循环任务
+        self.startup_task = None  # 启动阶段的 run_continuous 任务，退出信号直接取消
+        self.background_tasks = set()
+        self.drop_scheduler = DropWindowScheduler(self.config["monitoring"])
+        self.page_lock = asyncio.Lock()  # 直播间页面的搜索操作互斥
+
+        # 详情页处理流水线：扫描只负责点击商品，详情页由协程池并行处理
+        self.pipeline_config = self.config.get("pipeline", {})
+        self.product_queue = asyncio.Queue(self.pipeline_config.get("queue_size", 20))
+        self.product_workers = []
+        self.inflight_products = set()
+        self.handled_products = {}  # 商品标识 -> 最近处理完成时间
+
+        ledger_config = self.config.get("ledger", {})
+        self.ledger = None
+        if ledger_config.get("enabled", False):
+            self.ledger = DetectionLedger(
+                os.path.join(os.getcwd(), ledger_config.get("path", "ledger.db")),
+                owner=f"{os.getpid()}:{self.config['browser']['user_data_dir']}:{self.target_url}",
+                lease_seconds=ledger_config.get("lease_seconds", 30),
+                hold_seconds=ledger_config.get("hold_seconds", 300),
+            )
+        self.peer_checked_at = time.time()
+
+        self.profile_config = self.config.get("profile", {})
+        self.profile_compactor = ProfileCompactor(
+            self.user_data_dir, self.profile_config
+        )
+        self.launch_seconds = None
+
+        self.lag_monitor = None
+        self.profiler = None
+        self.dashboard = None
+        self.metrics_task = None
+        self.stock_config = self.config.get("stock_watch", {})
+        self.cycle_tracer = CycleTracer(self.config.get("tracing", {}))
+        self.evidence = EvidenceRecorder(self.config.get("evidence", {}))
+        self.cycle_failed = False  # 本轮检查是否出错
+
+        self.session_config = self.config.get("session", {})
+        self.session_probe = SessionProbe(self.session_config)
+        self.session_checked_at = None
+        self.session_healthy = False
+
+        history_config = self.config.get("history", {})
+        self.history = (
+            DetectionHistory(
+                os.path.join(os.getcwd(), history_config.get("path", "history.db")),
+                batch_size=history_config.get("batch_size", 100),
+                flush_interval=history_config.get("flush_interval", 1.0),
+            )
+            if history_config.get("enabled", True)
+            else None
+        )
+
+        websocket_config = self.config.get("websocket", {})
+        self.websocket_listener = (
+            WebSocketListener(self, websocket_config)
+            if websocket_config.get("enabled", False)
+            else None
+        )
+        self.fast_mode = False  # 发售窗口内的最快检测模式
+        self.warmed_up = False  # 当前窗口是否已完成预热
+
+        clock_config = self.config.get("clock", {})
+        self.clock = ServerClock(
+            clock_config.get("url", "https://www.taobao.com"),
+            samples=clock_config.get("samples", 12),
+            keep_ratio=clock_config.get("keep_ratio", 0.6),
+        )
 
     def play_beep(self, message=""):
         """播放beep声音提示"""
@@ -66,7 +2282,8 @@ class TaobaoLiveSearcher:
         except Exception as e:
             logger.error(f"❌ 播放beep失败: {e}")
 
-    def load_config(self, config_file):
+    @staticmethod
+    def load_config(config_file):
         """加载配置文件"""
         try:
             with open(config_file, "r", encoding="utf-8") as f:
@@ -83,81 +2300,102 @@ class TaobaoLiveSearcher:
             logger.error(f"❌ 加载配置文件失败: {e}")
             raise
 
-    def install_playwright_browsers(self):
-        """安装Playwright浏览器"""
-        try:
-            logger.info("📥 正在安装Playwright浏览器，请稍候...")
-            logger.info("⏳ 这可能需要几分钟时间，请耐心等待...")
+    async def provision_browser(self):
+        """确认当前修订号的浏览器已安装，未安装时异步安装（浏览器启动失败时调用）"""
+        browser_config = self.config["browser"]
+        if self.browser is not None or not browser_config.get("auto_install", True):
+            return True
+        ready = await browser_install.ensure_browser(
+            on_progress=lambda line: logger.info(f"📥 {line}"),
+            timeout=browser_config.get("install_timeout", 600),
+        )
+        if not ready:
+            logger.error("❌ 无法安装浏览器，程序无法继续")
+        return ready
 
-            # 运行playwright install命令
-            result = subprocess.run(
-                [sys.executable, "-m", "playwright", "install", "chromium"],
-                capture_output=True,
-                text=True,
-                timeout=600,  # 10分钟超时
+    async def launch_browser(self):
+        """根据运行模式启动浏览器并创建上下文"""
+        if not self.storage_state:
+            self.browser = await self.playwright.chromium.launch_persistent_context(
+                user_data_dir=self.user_data_dir,
+                headless=self.config["browser"]["headless"],
+                args=self.config["browser"]["args"],
+                user_agent=self.config["browser"]["user_agent"],
             )
+            # 使用persistent_context时，browser就是context
+            self.context = self.browser
+            return
 
-            if result.returncode == 0:
-                logger.info("✅ Playwright浏览器安装成功")
-                return True
-            else:
-                logger.error(f"❌ 浏览器安装失败: {result.stderr}")
-                return False
+        # 分片模式：可能由工作进程注入共享的browser，否则自行启动
+        if self.browser is None:
+            self.browser = await self.playwright.chromium.launch(
+                headless=self.config["browser"]["headless"],
+                args=self.config["browser"]["args"],
+            )
+        self.context = await self.browser.new_context(
+            storage_state=self.storage_state,
+            user_agent=self.config["browser"]["user_agent"],
+        )
 
-        except subprocess.TimeoutExpired:
-            logger.error("❌ 浏览器安装超时")
-            return False
-        except Exception as e:
-            logger.error(f"❌ 安装浏览器时出错: {e}")
-            return False
+    async def compact_profile_if_needed(self):
+        """用户目录超过大小上限时，在启动浏览器前清理缓存"""
+        if not self.profile_config.get("auto_compact", True):
+            return
+        compactor = self.profile_compactor
+        if not await asyncio.to_thread(compactor.needs_compaction):
+            return
+        before, after = await asyncio.to_thread(compactor.compact)
+        logger.info(
+            f"🧹 用户目录已压缩: {before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB"
+        )
+        last_launch = compactor.last_launch_seconds()
+        if last_launch is not None:
+            logger.info(f"⏱️ 压缩前上次浏览器启动耗时 {last_launch:.2f} 秒")
 
     async def setup_browser(self):
         """设置Playwright浏览器"""
         try:
             logger.info("🚀 正在启动Playwright浏览器...")
-            self.playwright = await async_playwright().start()
+            if self.browser is None:
+                self.playwright = await async_playwright().start()
 
-            # 确保用户数据目录存在
-            if not os.path.exists(self.user_data_dir):
-                os.makedirs(self.user_data_dir)
-                logger.info(f"📁 创建用户数据目录: {self.user_data_dir}")
-            else:
-                logger.info(f"📁 使用现有用户数据目录: {self.user_data_dir}")
+            if not self.storage_state:
+                # 确保用户数据目录存在
+                if not os.path.exists(self.user_data_dir):
+                    os.makedirs(self.user_data_dir)
+                    logger.info(f"📁 创建用户数据目录: {self.user_data_dir}")
+                else:
+                    logger.info(f"📁 使用现有用户数据目录: {self.user_data_dir}")
+                    await self.compact_profile_if_needed()
 
             # 尝试启动Chromium浏览器
             try:
-                self.browser = await self.playwright.chromium.launch_persistent_context(
-                    user_data_dir=self.user_data_dir,
-                    headless=self.config["browser"]["headless"],
-                    args=self.config["browser"]["args"],
-                    user_agent=self.config["browser"]["user_agent"],
-                )
-                # 使用persistent_context时，browser就是context
-                self.context = self.browser
+                started = time.perf_counter()
+                await self.launch_browser()
+                self.launch_seconds = time.perf_counter() - started
+                logger.info(f"⏱️ 浏览器启动耗时 {self.launch_seconds:.2f} 秒")
+                if not self.storage_state:
+                    self.profile_compactor.save_launch_seconds(self.launch_seconds)
 
             except Exception as browser_error:
                 logger.warning(f"⚠️ 浏览器启动失败: {browser_error}")
-                logger.info("🔄 检测到浏览器未安装，正在自动安装...")
+                logger.info("🔄 检查浏览器安装...")
 
                 # 自动安装浏览器
-                if self.install_playwright_browsers():
+                if await self.provision_browser():
                     logger.info("🔄 重新尝试启动浏览器...")
                     # 重新尝试启动浏览器
-                    self.browser = (
-                        await self.playwright.chromium.launch_persistent_context(
-                            user_data_dir=self.user_data_dir,
-                            headless=self.config["browser"]["headless"],
-                            args=self.config["browser"]["args"],
-                            user_agent=self.config["browser"]["user_agent"],
-                        )
-                    )
-                    self.context = self.browser
+                    await self.launch_browser()
                 else:
-                    logger.error("❌ 无法安装浏览器，程序无法继续")
                     return False
 
-            logger.info("✅ Playwright浏览器启动成功 (持久化模式)")
-            logger.info("🔐 登录状态将会保持，下次启动无需重新登录")
+            if self.storage_state:
+                logger.info(
+                    f"✅ Playwright浏览器启动成功 (快照模式: {self.storage_state})"
+                )
+            else:
+                logger.info("✅ Playwright浏览器启动成功 (持久化模式)")
+                logger.info("🔐 登录状态将会保持，下次启动无需重新登录")
             return True
 
         except Exception as e:
@@ -174,6 +2412,7 @@ class TaobaoLiveSearcher:
             pages = self.context.pages
             if pages:
                 self.page = pages[0]
+                newly_attached = self.attach_websocket_listener()
 
                 # 检查当前页面是否已经是目标直播间
                 current_url = self.page.url
@@ -182,9 +2421,16 @@ class TaobaoLiveSearcher:
                     or "tbzb.taobao.com/live" in current_url
                 ):
                     logger.info("✅ 直播间页面已经打开，无需重复打开")
+                    if newly_attached:
+                        # 重新加载以捕获页面已建立的WebSocket连接
+                        await self.page.reload(
+                            wait_until="domcontentloaded",
+                            timeout=self.config["monitoring"]["page_timeout"],
+                        )
                     return True
             else:
                 self.page = await self.context.new_page()
+                self.attach_websocket_listener()
 
             logger.info(f"正在打开直播间: {self.target_url}")
             await self.page.goto(
@@ -201,8 +2447,75 @@ class TaobaoLiveSearcher:
             logger.error(f"❌ 打开直播间失败: {e}")
             return False
 
-    async def clear_search_input(self):
+    def attach_websocket_listener(self):
+        """在直播间页面上启用WebSocket推送监听（如已配置）"""
+        if self.websocket_listener is None:
+            return False
+        return self.websocket_listener.attach(self.page)
+
+    def match_keyword(self, text):
+        """返回text中包含的第一个搜索关键字，没有则返回None"""
+        if not text:
+            return None
+        lowered = text.lower()
+        for keyword in self.search_keywords:
+            if keyword.lower() in lowered:
+                return keyword
+        return None
+
+    async def handle_push_match(self, keyword, product):
+        """处理WebSocket推送命中的商品：立即进入点击流程，点击发出后推送事件"""
+        try:
+            detection = Detection(
+                keyword=keyword,
+                text=product["title"],
+                goods_num=product["goods_num"],
+                selector="websocket",
+                room=self.target_url,
+            )
+            self.keyword_planner.record(keyword, True)
+            try:
+                await self.open_push_product(keyword, product)
+            finally:
+                # 点击发出后再推送给订阅者，block 策略的反压不会延迟点击
+                await self.emit_detection(detection)
+        except Exception as e:
+            logger.error(f"❌ 处理推送商品失败: {e}")
+
+    async def open_push_product(self, keyword, product):
+        """打开推送中的商品：有链接时直接打开详情页，否则对该关键字执行一次定向搜索"""
+        product_key = product["goods_num"] or product["title"]
+        if product["url"]:
+            # 推送中带有商品链接：直接打开详情页并交给处理队列
+            if not await self.claim_product(product_key):
+                return
+            page = None
+            try:
+                page = await self.context.new_page()
+                await page.goto(
+                    product["url"],
+                    wait_until="domcontentloaded",
+                    timeout=self.config["monitoring"]["page_timeout"],
+                )
+            except Exception:
+                self.release_product(product_key)
+                if page:
+                    self.spawn(self.close_detail_page(page))
+                raise
+            await self.product_queue.put(
+                (page, keyword, product["title"], product_key, product["goods_num"])
+            )
+            return
+
+        deadline = CycleDeadline(self.pipeline_config.get("detail_budget", 15))
+        async with self.page_lock:
+            if await self.input_search_keyword(keyword, deadline):
+                await self.search_products_for_keyword(keyword, deadline)
+        self.record_overruns(deadline.overruns)
+
+    async def clear_search_input(self, deadline=None):
         """清空搜索框内容"""
+        deadline = deadline or CycleDeadline()
         try:
             logger.info("🧹 正在清空搜索框内容...")
 
@@ -213,27 +2526,30 @@ class TaobaoLiveSearcher:
             # 等待搜索框出现
             await self.page.wait_for_selector(
                 search_input_selector,
-                timeout=self.config["monitoring"]["search_timeout"],
+                timeout=deadline.timeout_ms(
+                    self.config["monitoring"]["search_timeout"]
+                ),
             )
 
             # 清空搜索框内容
             search_input = await self.page.query_selector(search_input_selector)
             if search_input:
-                await search_input.fill("")
+                await search_input.fill("", timeout=deadline.timeout_ms(5000))
                 logger.info("✅ 搜索框内容已清空")
 
                 # 点击搜索按钮
                 search_btn = await self.page.query_selector(search_btn_selector)
                 if search_btn:
-                    await search_btn.click()
+                    await search_btn.click(timeout=deadline.timeout_ms(5000))
             else:
                 logger.warning("❌ 未找到搜索框")
 
         except Exception as e:
             logger.error(f"❌ 清空搜索框失败: {e}")
 
-    async def input_search_keyword(self, keyword):
+    async def input_search_keyword(self, keyword, deadline=None):
         """在搜索框中输入指定关键字并点击搜索"""
+        deadline = deadline or CycleDeadline()
         try:
             logger.info(f"🔍 正在输入搜索关键字: {keyword}")
 
@@ -244,172 +2560,576 @@ class TaobaoLiveSearcher:
             # 等待搜索框出现
             await self.page.wait_for_selector(
                 search_input_selector,
-                timeout=self.config["monitoring"]["search_timeout"],
+                timeout=deadline.timeout_ms(
+                    self.config["monitoring"]["search_timeout"]
+                ),
             )
 
             # 清空搜索框并输入关键字
-            search_input = await self.page.query_selector(search_input_selector)
+            search_input = await deadline.run(
+                "input_search_keyword", self.page.query_selector(search_input_selector)
+            )
             if search_input:
                 # 输入关键字
-                await search_input.fill(keyword)
+                await search_input.fill(keyword, timeout=deadline.timeout_ms(5000))
                 logger.info(f"✅ 已输入关键字: {keyword}")
 
                 # 点击搜索按钮
-                search_btn = await self.page.query_selector(search_btn_selector)
+                search_btn = await deadline.run(
+                    "input_search_keyword",
+                    self.page.query_selector(search_btn_selector),
+                )
                 if search_btn:
-                    await search_btn.click()
+                    await search_btn.click(timeout=deadline.timeout_ms(5000))
                     logger.info("✅ 已点击搜索按钮")
                 else:
                     # 如果没找到搜索按钮，尝试按回车
                     logger.info("未找到搜索按钮，使用回车键搜索")
-                    await search_input.press("Enter")
+                    await search_input.press("Enter", timeout=deadline.timeout_ms(5000))
 
                 # 等待搜索结果加载
-                await self.page.wait_for_timeout(500)
+                await self.page.wait_for_timeout(deadline.timeout_ms(500))
                 return True
             else:
                 logger.warning("❌ 未找到搜索框")
                 return False
 
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if deadline.expired:
+                deadline.overrun("input_search_keyword")
+            self.play_beep("输入搜索关键字失败")
+            logger.error(f"❌ 输入搜索关键字失败: {e}")
+            return False
+
+    async def search_products_for_keyword(self, keyword, deadline=None):
+        """搜索指定关键字的商品"""
+        deadline = deadline or CycleDeadline()
+        try:
+            logger.info(f"🔍 搜索关键字: {keyword}")
+            await self.page.wait_for_timeout(deadline.timeout_ms(500))
+
+            # 使用配置文件中的商品选择器
+            selectors = [self.config["selectors"]["product_title"]]
+            products_found = []
+
+            for selector in selectors:
+                try:
+                    elements = await deadline.run(
+                        "search_products_for_keyword",
+                        self.page.query_selector_all(selector),
+                    )
+                    if elements:
+                        logger.info(f"找到 {len(elements)} 个元素 ({selector})")
+
+                        for i, element in enumerate(elements[:20]):  # 增加搜索数量
+                            try:
+                                deadline.check("search_products_for_keyword")
+                                text = await element.text_content(
+                                    timeout=deadline.timeout_ms(5000)
+                                )
+
+                                # 检查是否包含当前关键字
+                                if text and keyword.lower() in text.lower():
+                                    logger.info(f"✅ 找到商品: {text.strip()[:100]}...")
+
+                                    # 先读取商品编号并立即推送检测事件，再处理详情页
+                                    goods_num = await self.get_goods_number(
+                                        element, deadline
+                                    )
+                                    detection = Detection(
+                                        keyword=keyword,
+                                        index=i,
+                                        text=text.strip(),
+                                        selector=selector,
+                                        goods_num=goods_num,
+                                        room=self.target_url,
+                                    )
+                                    products_found.append(detection.to_dict())
+                                    if goods_num:
+                                        logger.info(f"   商品编号: {goods_num}")
+                                    try:
+                                        await self.click_product(
+                                            element,
+                                            keyword,
+                                            text.strip(),
+                                            goods_num,
+                                            deadline,
+                                        )
+                                    finally:
+                                        # 点击发出后再推送给订阅者，block 策略的反压不会延迟点击
+                                        await self.emit_detection(detection)
+                            except DeadlineExceeded:
+                                raise
+                            except Exception:
+                                continue
+                except DeadlineExceeded:
+                    raise
+                except Exception:
+                    continue
+
+            return products_found
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"❌ 搜索关键字 {keyword} 出错: {e}")
+            return []
+
+    async def click_product(self, element, keyword, text, goods_num, deadline):
+        """点击命中的商品：新页面交给详情页处理队列，未打开新页面时在当前页面处理"""
+        # 同一商品已在处理中或刚处理过则不再重复点击
+        product_key = goods_num or text
+        if not await self.claim_product(product_key):
+            logger.info("⏭️ 商品已在处理队列中，跳过点击")
+            return
+
+        # 点击商品链接，新页面打开后立即交给详情页处理协程
+        new_page = None
+        clicked = False
+        try:
+            async with self.context.expect_page(
+                timeout=deadline.timeout_ms(
+                    self.pipeline_config.get("new_page_timeout", 2000)
+                )
+            ) as page_info:
+                await element.click(timeout=deadline.timeout_ms(5000))
+                clicked = True
+                logger.info("🖱️ 已点击商品")
+            new_page = await page_info.value
+        except PlaywrightTimeoutError:
+            if not clicked:
+                # 点击本身超时：跳过该商品
+                self.release_product(product_key)
+                raise
+            # 已点击但未打开新页面：在当前页面处理
+        except Exception:
+            self.release_product(product_key)
+            raise
+
+        if new_page:
+            logger.info("🔄 商品页面已打开，加入详情页处理队列")
+            await self.product_queue.put(
+                (new_page, keyword, text, product_key, goods_num)
+            )
+        else:
+            # 未打开新页面：只能在当前页面处理
+            logger.info("🔄 在当前页面处理商品")
+            bought = False
+            try:
+                bought = await self.handle_product_page(
+                    self.page, keyword, text, goods_num, deadline
+                )
+            finally:
+                self.finish_product(product_key, bought)
+
+    def record_latency(self, stage, seconds):
+        """记录阶段耗时"""
+        if self.history:
+            self.history.record_latency(self.target_url, stage, seconds)
+        if self.dashboard:
+            self.dashboard.record_stage(stage, seconds)
+
+    def record_overruns(self, overruns):
+        """把超出时间预算的阶段写入检测历史和面板"""
+        for stage in overruns:
+            if self.history:
+                self.history.record_overrun(self.target_url, stage)
+            if self.dashboard:
+                self.dashboard.record_overrun(stage)
+
+    def start_history(self):
+        """打开检测历史库，并用历史统计初始化关键字和发售窗口调度"""
+        if not self.history:
+            return
+        try:
+            self.history.start()
+            history_config = self.config.get("history", {})
+            days = history_config.get("seed_days", 30)
+            self.keyword_planner.seed(self.history.keyword_stats(self.target_url, days))
+
+            schedule_config = self.config["monitoring"].get("schedule", {})
+            if schedule_config.get("learn_from_history", False):
+                hours = self.history.appearance_hours(
+                    self.target_url, days, schedule_config.get("learned_windows", 3)
+                )
+                for hour in hours:
+                    self.drop_scheduler.add_cron_window(f"0 {hour} * * *", 3600)
+                if hours:
+                    logger.info(f"📈 根据历史记录添加发售窗口: {sorted(hours)} 点")
+        except Exception as e:
+            logger.error(f"❌ 打开检测历史失败: {e}")
+            self.history = None
+
+    def spawn(self, coro):
+        """创建后台任务并保留引用，避免任务被提前回收"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    async def claim_product(self, product_key):
+        """登记待处理商品，已在处理中、去重窗口内处理过或被其它实例占用则返回False"""
+        now = time.time()
+        handled_at = self.handled_products.get(product_key)
+        if product_key in self.inflight_products or (
+            handled_at is not None
+            and now - handled_at < self.pipeline_config.get("dedup_seconds", 300)
+        ):
+            return False
+        self.inflight_products.add(product_key)
+
+        if self.ledger:
+            try:
+                claimed = await asyncio.to_thread(
+                    self.ledger.claim, self.target_url, product_key
+                )
+            except Exception as e:
+                logger.error(f"❌ 申请账本租约失败: {e}")
+                claimed = True  # 账本不可用时不影响本实例处理
+            if not claimed:
+                self.inflight_products.discard(product_key)
+                logger.info(f"🔒 商品 {product_key} 已由其它实例处理，跳过")
+                return False
+        return True
+
+    def release_product(self, product_key):
+        """商品未完成点击：取消登记并释放账本租约，本实例或其它实例可再次处理"""
+        self.inflight_products.discard(product_key)
+        if self.ledger:
+            self.spawn(
+                asyncio.to_thread(self.ledger.release, self.target_url, product_key)
+            )
+
+    def mark_product_handled(self, product_key):
+        """已点击购买按钮：记录处理时间，去重窗口内不再重复处理"""
+        self.inflight_products.discard(product_key)
+        now = time.time()
+        # 只保留去重窗口内的记录，避免长时间运行时无限增长
+        dedup_seconds = self.pipeline_config.get("dedup_seconds", 300)
+        self.handled_products = {
+            key: handled_at
+            for key, handled_at in self.handled_products.items()
+            if now - handled_at < dedup_seconds
+        }
+        self.handled_products[product_key] = now
+        if self.ledger:
+            self.spawn(
+                asyncio.to_thread(self.ledger.complete, self.target_url, product_key)
+            )
+
+    def finish_product(self, product_key, clicked):
+        """详情页处理结束：点击成功则记录去重，否则释放以便重试"""
+        if clicked:
+            self.mark_product_handled(product_key)
+        else:
+            self.release_product(product_key)
+
+    async def close_detail_page(self, page):
+        """关闭处理完的详情页（先等证据采集取完数据），避免长时间运行时标签页不断增长"""
+        try:
+            await self.evidence.wait_captures()
+            await page.close()
         except Exception as e:
-            self.play_beep("输入搜索关键字失败")
-            logger.error(f"❌ 输入搜索关键字失败: {e}")
-            return False
+            logger.warning(f"⚠️ 关闭详情页失败: {e}")
 
-    async def search_products_for_keyword(self, keyword):
-        """搜索指定关键字的商品"""
+    async def check_peer_sightings(self):
+        """读取其它实例发布的商品出现记录，相关关键字下一轮优先搜索"""
+        if not self.ledger:
+            return
         try:
-            logger.info(f"🔍 搜索关键字: {keyword}")
-            await self.page.wait_for_timeout(500)
+            since, self.peer_checked_at = self.peer_checked_at, time.time()
+            sightings = await asyncio.to_thread(self.ledger.peer_sightings, since)
+            for _, owner, room, keyword, goods_num, title in sightings:
+                logger.info(
+                    f"👥 其它实例发现商品: {title[:60]} ({goods_num or '无编号'}) @ {room}"
+                )
+                self.keyword_planner.boost(keyword)
+            await asyncio.to_thread(self.ledger.prune)
+        except Exception as e:
+            logger.error(f"❌ 读取账本出现记录失败: {e}")
 
-            # 使用配置文件中的商品选择器
-            selectors = [self.config["selectors"]["product_title"]]
-            products_found = []
+    def start_product_workers(self):
+        """启动详情页处理协程池"""
+        if self.product_workers:
+            return
+        for worker_id in range(self.pipeline_config.get("workers", 2)):
+            self.product_workers.append(
+                asyncio.create_task(self.product_worker(worker_id))
+            )
 
-            for selector in selectors:
-                try:
-                    elements = await self.page.query_selector_all(selector)
-                    if elements:
-                        logger.info(f"找到 {len(elements)} 个元素 ({selector})")
+    async def stop_product_workers(self):
+        """停止详情页处理协程池"""
+        for worker in self.product_workers:
+            worker.cancel()
+        await asyncio.gather(*self.product_workers, return_exceptions=True)
+        self.product_workers = []
 
-                        for i, element in enumerate(elements[:20]):  # 增加搜索数量
-                            try:
-                                text = await element.text_content()
+    async def product_worker(self, worker_id):
+        """从队列中取出商品详情页并处理，与扫描并行进行"""
+        while True:
+            page, keyword, product_text, product_key, goods_num = (
+                await self.product_queue.get()
+            )
+            deadline = CycleDeadline(self.pipeline_config.get("detail_budget", 15))
+            clicked = False
+            try:
+                clicked = await self.handle_product_page(
+                    page, keyword, product_text, goods_num, deadline
+                )
+            except Exception as e:
+                logger.error(f"❌ 详情页处理协程 {worker_id} 出错: {e}")
+            finally:
+                self.record_overruns(deadline.overruns)
+                self.finish_product(product_key, clicked)
+                if page is not self.page:
+                    self.spawn(self.close_detail_page(page))
+                self.product_queue.task_done()
 
-                                # 检查是否包含当前关键字
-                                if text and keyword.lower() in text.lower():
-                                    logger.info(f"✅ 找到商品: {text.strip()[:100]}...")
+    def subscribe(self, maxsize=None, overflow=None):
+        """注册一个检测事件订阅者"""
+        watch_config = self.config.get("watch", {})
+        subscription = DetectionSubscription(
+            maxsize if maxsize is not None else watch_config.get("queue_size", 100),
+            overflow or watch_config.get("overflow", "block"),
+        )
+        self.subscribers.append(subscription)
+        return subscription
 
-                                    # 记录当前页面数量
-                                    current_pages = len(self.context.pages)
+    def unsubscribe(self, subscription):
+        """注销检测事件订阅者"""
+        if subscription in self.subscribers:
+            self.subscribers.remove(subscription)
 
-                                    # 点击商品链接
-                                    await element.click()
-                                    logger.info("🖱️ 已点击商品")
+    async def emit_detection(self, detection):
+        """将检测事件推送给所有订阅者（以及分片模式下的协调进程）"""
+        if self.dashboard:
+            self.dashboard.record_hit(detection)
+        if self.history:
+            self.history.record_sighting(
+                detection,
+                source="websocket" if detection.selector == "websocket" else "dom",
+            )
+        if self.ledger:
+            # 账本写入可能因其它实例竞争而等待，放到后台，不延迟事件推送和点击
+            self.spawn(self.publish_sighting(detection))
+        for subscription in list(self.subscribers):
+            await subscription.put(detection)
+        self.publish_detection(detection)
 
-                                    # 等待新页面加载
-                                    await self.page.wait_for_timeout(2000)
+    async def publish_sighting(self, detection):
+        """在线程中向共享账本发布商品出现记录"""
+        try:
+            await asyncio.to_thread(self.ledger.publish_sighting, detection)
+        except Exception as e:
+            logger.error(f"❌ 发布出现记录失败: {e}")
 
-                                    # 检查是否有新页面打开
-                                    new_pages = len(self.context.pages)
-                                    if new_pages > current_pages:
-                                        # 切换到新页面
-                                        logger.info("🔄 切换到新打开的商品页面")
-                                        new_page = self.context.pages[-1]  # 最新的页面
-                                        await self.handle_product_page(
-                                            new_page, keyword, text.strip()
-                                        )
-                                    else:
-                                        # 在当前页面查找购买按钮
-                                        logger.info("🔄 在当前页面处理商品")
-                                        await self.handle_product_page(
-                                            self.page, keyword, text.strip()
-                                        )
+    def publish_detection(self, detection):
+        """分片模式下将检测结果发送给协调进程"""
+        if self.detection_queue is None:
+            return
+        try:
+            self.detection_queue.put_nowait(
+                {**detection.to_dict(), "shard_id": self.shard_id}
+            )
+        except Exception as e:
+            logger.error(f"❌ 上报检测结果失败: {e}")
 
-                                    # 获取商品编号
-                                    goods_num = await self.get_goods_number(element)
+    def select_buy_button(self, buy_buttons):
+        """按配置的序号选择购买按钮（默认第二个，不足时取最后一个）"""
+        if not buy_buttons:
+            return None
+        index = self.stock_config.get("buy_button_index", 1)
+        if len(buy_buttons) > index:
+            if len(buy_buttons) > 1:
+                logger.info(f"找到多个购买按钮，选择第 {index + 1} 个")
+            return buy_buttons[index]
+        return buy_buttons[-1]
 
-                                    product_info = {
-                                        "keyword": keyword,
-                                        "index": i,
-                                        "text": text.strip(),
-                                        "selector": selector,
-                                        "goods_num": goods_num,
-                                    }
+    async def wait_for_buy_button(self, page, selector, buy_button, deadline):
+        """在页面内等待购买按钮变为可购买，返回可点击的按钮，超时返回None"""
+        watch_deadline = deadline.share(1.0)
+        watch_timeout = self.stock_config.get("timeout", 10000)
+        stop_at = time.monotonic() + watch_timeout / 1000
+        options = {
+            "disabledTexts": self.stock_config.get(
+                "disabled_texts",
+                ["已售罄", "已抢光", "即将开售", "暂时缺货", "不可购买"],
+            ),
+            "disabledClassPattern": self.stock_config.get(
+                "disabled_class_pattern", "disable|soldout|gray"
+            ),
+        }
 
-                                    products_found.append(product_info)
-                                    if goods_num:
-                                        logger.info(f"   商品编号: {goods_num}")
-                            except:
-                                continue
-                except:
-                    continue
+        started = time.perf_counter()
+        while True:
+            remaining_ms = min(
+                (stop_at - time.monotonic()) * 1000,
+                watch_deadline.timeout_ms(watch_timeout),
+            )
+            if remaining_ms <= 0:
+                break
+            state = await watch_deadline.run(
+                "wait_for_buy_button",
+                buy_button.evaluate(
+                    BUY_BUTTON_WATCH_SCRIPT, {**options, "timeout": remaining_ms}
+                ),
+            )
+            if state["ready"]:
+                if state["changed"]:
+                    logger.info(
+                        f"🟢 等待 {(time.perf_counter() - started) * 1000:.0f} ms 后"
+                        f"购买按钮变为可用: {state['text'][:20]}"
+                    )
+                return buy_button
+            if not state["changed"]:
+                break
+            logger.info(f"⏳ 购买按钮暂不可用 ({state['text'][:20]})，继续观察...")
 
-            return products_found
+            if not state["connected"]:
+                # 按钮被重新渲染：重新查找后继续观察
+                buy_button = self.select_buy_button(
+                    await page.query_selector_all(selector)
+                )
+                if not buy_button:
+                    break
 
-        except Exception as e:
-            logger.error(f"❌ 搜索关键字 {keyword} 出错: {e}")
-            return []
+        logger.warning("⌛ 等待购买按钮可用超时")
+        return None
 
-    async def handle_product_page(self, page, keyword, product_text):
-        """处理商品详情页面，查找并点击购买按钮"""
+    async def handle_product_page(
+        self, page, keyword, product_text, goods_num=None, deadline=None
+    ):
+        """处理商品详情页面，查找并点击购买按钮，返回是否已点击"""
+        deadline = deadline or CycleDeadline()
+        started = time.perf_counter()
+        clicked = False
+        clicked_at = None  # 点击时间，同时写入点击记录和证据记录
         try:
             logger.info(f"📄 正在处理商品页面: {product_text[:50]}...")
 
             # 等待页面加载
-            await page.wait_for_timeout(1000)
+            await page.wait_for_timeout(deadline.timeout_ms(1000))
 
             # 使用配置文件中的购买按钮选择器
             buy_button_selectors = [self.config["selectors"]["buy_button"]]
 
             for selector in buy_button_selectors:
                 try:
-                    buy_buttons = await page.query_selector_all(selector)
-
-                    buy_button = None
-                    if len(buy_buttons) > 1:
-                        logger.info("找到多个购买按钮，选择第二个")
-                        buy_button = buy_buttons[1]
-                    elif len(buy_buttons) == 1:
-                        buy_button = buy_buttons[0]
+                    buy_buttons = await deadline.run(
+                        "handle_product_page", page.query_selector_all(selector)
+                    )
 
+                    buy_button = self.select_buy_button(buy_buttons)
                     if not buy_button:
                         logger.warning(f"❌ 未找到购买按钮: {selector}")
                         continue
 
                     logger.info(f"🛒 找到购买按钮: (选择器: {selector})")
 
+                    # 按钮暂不可购买时留在详情页，等待其变为可购买
+                    if self.stock_config.get("enabled", True):
+                        buy_button = await self.wait_for_buy_button(
+                            page, selector, buy_button, deadline
+                        )
+                        if not buy_button:
+                            continue
+
                     # 点击购买按钮
-                    await buy_button.click()
+                    await buy_button.click(
+                        timeout=deadline.timeout_ms(
+                            self.config["monitoring"]["page_timeout"]
+                        )
+                    )
+                    clicked = True
+                    clicked_at = time.time()
+                    # 点击已发出：证据采集在后台进行，不影响点击耗时
+                    self.evidence.capture(
+                        page, self.target_url, keyword, goods_num, clicked_at
+                    )
 
                     # 播放声音，提示购买按钮已点击
                     self.play_beep("购买按钮已点击")
                     logger.info("🔊 已播放提示音 - 购买按钮已点击")
 
                     break
-                except:
+                except DeadlineExceeded:
+                    raise
+                except Exception:
+                    if deadline.expired:
+                        deadline.overrun("handle_product_page")
                     continue
 
             # 等待一下再继续
-            await page.wait_for_timeout(200)
+            await page.wait_for_timeout(deadline.timeout_ms(200))
 
+        except DeadlineExceeded:
+            logger.warning("⏰ 商品页面处理超出时间预算")
+            raise
         except Exception as e:
             logger.error(f"❌ 处理商品页面失败: {e}")
+        finally:
+            self.record_latency("detail", time.perf_counter() - started)
+            if self.history:
+                self.history.record_click(
+                    self.target_url, keyword, goods_num, clicked, clicked_at
+                )
+        return clicked
 
-    async def search_all_keywords(self):
-        """搜索所有关键字"""
+    async def search_all_keywords(self, deadline=None):
+        """搜索所有关键字，剩余时间预算在尚未搜索的关键字之间平均分配"""
+        deadline = deadline or CycleDeadline()
+        input_share = self.config["monitoring"].get("input_share", 0.4)
         try:
             all_products = []
 
-            logger.info(f"🎯 开始搜索 {len(self.search_keywords)} 个关键字")
+            keywords = self.keyword_planner.plan(fast=self.fast_mode)
+            logger.info(
+                f"🎯 本轮搜索 {len(keywords)}/{len(self.search_keywords)} 个关键字"
+            )
+
+            for i, keyword in enumerate(keywords):
+                if deadline.expired:
+                    logger.warning(
+                        f"⏰ 检查时间预算已用完，跳过剩余 {len(keywords) - i} 个关键字"
+                    )
+                    break
+                logger.info(f"📍 搜索进度: {i+1}/{len(keywords)}")
+                keyword_deadline = deadline.share(1 / (len(keywords) - i))
 
-            for i, keyword in enumerate(self.search_keywords):
-                logger.info(f"📍 搜索进度: {i+1}/{len(self.search_keywords)}")
+                # 输入搜索关键字并搜索当前关键字的商品
+                searched = False
+                products = []
+                try:
+                    async with self.page_lock:
+                        started = time.perf_counter()
+                        searched = await self.input_search_keyword(
+                            keyword, keyword_deadline.share(input_share)
+                        )
+                        self.record_latency(
+                            "search_input", time.perf_counter() - started
+                        )
+                        if searched:
+                            started = time.perf_counter()
+                            products = await self.search_products_for_keyword(
+                                keyword, keyword_deadline
+                            )
+                            self.record_latency("scan", time.perf_counter() - started)
+                except DeadlineExceeded as e:
+                    logger.warning(f"⏰ 关键字 '{keyword}' {e}")
+                    continue
 
-                # 输入搜索关键字
-                if await self.input_search_keyword(keyword):
-                    # 搜索当前关键字的商品
-                    products = await self.search_products_for_keyword(keyword)
+                if searched:
+                    self.keyword_planner.record(keyword, bool(products))
+                    if self.dashboard:
+                        self.dashboard.record_scan(
+                            self.target_url, keyword, bool(products)
+                        )
+                    if self.history:
+                        self.history.record_scan(
+                            self.target_url, keyword, bool(products)
+                        )
 
                     if products:
                         logger.info(
@@ -419,31 +3139,39 @@ class TaobaoLiveSearcher:
                     else:
                         logger.info(f"⚠️ 关键字 '{keyword}' 未找到商品")
                         # 在页面文本中搜索
-                        await self.search_keyword_in_page_text(keyword)
+                        await self.search_keyword_in_page_text(
+                            keyword, keyword_deadline
+                        )
                 else:
                     logger.warning(f"❌ 关键字 '{keyword}' 搜索输入失败")
 
-                # 每个关键字搜索之间等待一下
-                await asyncio.sleep(2)
+                # 每个关键字搜索之间等待一下（发售窗口内缩短间隔）
+                await asyncio.sleep(min(self.keyword_interval(), deadline.remaining()))
 
-            await self.clear_search_input()
+            await self.clear_search_input(deadline)
 
             if all_products:
                 logger.info(f"🎉 总共找到 {len(all_products)} 个相关商品")
-                self.display_products_by_keyword(all_products)
+                if not self.dashboard:
+                    # 面板模式下由面板显示命中，避免打印打乱画面
+                    self.display_products_by_keyword(all_products)
             else:
                 logger.info("❌ 所有关键字都未找到商品")
 
             return all_products
 
         except Exception as e:
+            self.cycle_failed = True
             logger.error(f"❌ 搜索所有关键字出错: {e}")
             return []
 
-    async def search_keyword_in_page_text(self, keyword):
+    async def search_keyword_in_page_text(self, keyword, deadline=None):
         """在页面文本中搜索指定关键字"""
+        deadline = deadline or CycleDeadline()
         try:
-            page_text = await self.page.text_content("body")
+            page_text = await self.page.text_content(
+                "body", timeout=deadline.timeout_ms(5000)
+            )
 
             if keyword.lower() in page_text.lower():
                 logger.info(f"✅ 在页面中找到关键词: {keyword}")
@@ -490,15 +3218,18 @@ class TaobaoLiveSearcher:
         print(f"\n📊 总计找到 {len(products)} 个商品")
         print("=" * 60)
 
-    async def get_goods_number(self, element):
+    async def get_goods_number(self, element, deadline=None):
         """获取商品编号 - 从元素的祖父节点查找"""
+        deadline = deadline or CycleDeadline()
         try:
             # 使用配置文件中的商品编号选择器
             goods_selector = self.config["selectors"]["goods_number"]
 
             # 使用 evaluate 在浏览器中执行查找，直接返回商品编号文本
-            goods_num = await element.evaluate(
-                f"""
+            goods_num = await deadline.run(
+                "get_goods_number",
+                element.evaluate(
+                    f"""
                 element => {{
                     const greatGrandparent = element.parentElement?.parentElement?.parentElement;
                     if (greatGrandparent) {{
@@ -508,10 +3239,13 @@ class TaobaoLiveSearcher:
                     return null;
                 }}
             """
+                ),
             )
 
             return goods_num if goods_num else None
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"❌ 获取商品编号失败: {e}")
             return None
@@ -548,56 +3282,332 @@ class TaobaoLiveSearcher:
                 print("商品编号: 未找到")
             print("-" * 30)
 
-    async def run_continuous(self):
-        """持续运行程序，使用配置文件中的检查间隔"""
-        try:
-            logger.info("🚀 启动持续监控程序...")
+    async def probe_session(self):
+        """检查登录状态，返回是否有效"""
+        healthy, reason, elapsed_ms = await self.session_probe.check(self.context)
+        self.session_checked_at = time.monotonic()
+        self.session_healthy = healthy
+        if healthy:
+            logger.info(f"🔐 {reason} ({elapsed_ms:.1f} ms)")
+        else:
+            logger.warning(f"⚠️ 登录状态失效: {reason} ({elapsed_ms:.1f} ms)")
+        return healthy
+
+    async def ensure_session(self):
+        """定期检查登录状态；失效时暂停扫描并提醒，直到重新登录"""
+        if not self.session_config.get("enabled", True):
+            return
+        interval = self.session_config.get("check_interval", 300)
+        if (
+            self.session_healthy
+            and time.monotonic() - self.session_checked_at < interval
+        ):
+            return
+        if await self.probe_session():
+            return
+
+        self.play_beep("登录状态失效")
+        logger.warning("⏸️ 已暂停扫描，请在浏览器中重新登录淘宝账号")
+        recheck_interval = self.session_config.get("recheck_interval", 15)
+        while self.is_running:
+            await asyncio.sleep(recheck_interval)
+            if await self.probe_session():
+                logger.info("▶️ 登录状态已恢复，继续扫描")
+                return
 
-            # 初始化浏览器
+    async def sync_clock(self):
+        """按需同步服务器时钟（仅在配置了发售窗口时需要）"""
+        clock_config = self.config.get("clock", {})
+        if not clock_config.get("enabled", True) or not self.drop_scheduler.enabled:
+            return
+        if self.clock.is_stale(clock_config.get("resync_interval", 600)):
+            await self.clock.sync()
+
+    def start_lag_monitor(self):
+        """启动事件循环延迟监控（同一事件循环共享一个监控器）"""
+        lag_config = self.config.get("loop_lag", {})
+        if not lag_config.get("enabled", True):
+            return
+        self.lag_monitor = LoopLagMonitor.for_running_loop(lag_config)
+        self.lag_monitor.reporters.append(self.record_loop_lag)
+
+    def start_profiler(self):
+        """注册按信号开启的性能分析（同一事件循环共享一个分析器）"""
+        profiler_config = self.config.get("profiler", {})
+        if not profiler_config.get("enabled", True):
+            return
+        self.profiler = CycleProfiler.for_running_loop(profiler_config)
+
+    def start_dashboard(self):
+        """开启终端面板（分片模式下各工作进程不开启）"""
+        dashboard_config = self.config.get("dashboard", {})
+        if (
+            not dashboard_config.get("enabled", False)
+            or self.detection_queue is not None
+        ):
+            return
+        self.dashboard = Dashboard.for_running_loop(dashboard_config)
+        self.dashboard.lag_monitor = self.lag_monitor
+        self.dashboard.update_room(self.target_url, status="启动中")
+        self.metrics_task = asyncio.create_task(
+            self.sample_browser_metrics(dashboard_config.get("memory_interval", 5))
+        )
+
+    async def sample_browser_metrics(self, interval):
+        """通过CDP Performance.getMetrics定期采样直播间页面内存，供面板显示"""
+        session = None
+        while True:
+            try:
+                if session is None:
+                    session = await self.context.new_cdp_session(self.page)
+                    await session.send("Performance.enable")
+                result = await session.send("Performance.getMetrics")
+                metrics = {item["name"]: item["value"] for item in result["metrics"]}
+                self.dashboard.update_room(
+                    self.target_url,
+                    heap_mb=metrics.get("JSHeapUsedSize", 0) / 1024 / 1024,
+                    nodes=int(metrics.get("Nodes", 0)),
+                )
+            except Exception:
+                # 页面重新打开后需要新的CDP会话
+                session = None
+            await asyncio.sleep(interval)
+
+    def record_loop_lag(self, metrics):
+        """将事件循环延迟分位数写入检测历史"""
+        for name, value in metrics.items():
+            self.record_latency(f"loop_lag_{name}", value / 1000)
+
+    async def start(self):
+        """启动浏览器并打开直播间
+
+        时钟同步与浏览器启动并行进行；浏览器直接启动，只有启动失败时才检查和安装。
+        """
+        self.start_lag_monitor()
+        self.start_profiler()
+        clock_sync = asyncio.create_task(self.sync_clock())
+        try:
+            self.start_history()
+            self.evidence.history = self.history
+            self.evidence.start()
             if not await self.setup_browser():
                 return False
+            await clock_sync
+        finally:
+            clock_sync.cancel()
+        if self.session_config.get("enabled", True):
+            await self.probe_session()
+        self.start_product_workers()
+        if not await self.open_live_room():
+            return False
+        self.start_dashboard()
+        return True
 
+    def keyword_interval(self):
+        """关键字之间的等待秒数"""
+        if self.fast_mode:
+            schedule_config = self.config["monitoring"].get("schedule", {})
+            return schedule_config.get("fast_keyword_interval", 0.2)
+        return self.config["monitoring"].get("keyword_interval", 2)
+
+    async def warm_up(self, window_start):
+        """发售窗口开始前预热浏览器和直播间页面"""
+        logger.info(
+            f"🔥 距离发售窗口还有 {window_start - self.clock.now():.0f} 秒，开始预热..."
+        )
+        try:
             if not await self.open_live_room():
                 return False
+            await self.page.wait_for_selector(
+                self.config["selectors"]["search_input"],
+                timeout=self.config["monitoring"]["search_timeout"],
+            )
+            # 预先执行一次页面脚本，确保渲染进程处于活跃状态
+            await self.page.evaluate("() => document.readyState")
+            logger.info("✅ 预热完成，窗口开始前以最快模式检测")
+            return True
+        except Exception as e:
+            logger.error(f"❌ 预热失败: {e}")
+            return False
 
-            min_interval = self.config["monitoring"]["min_interval"]
-            max_interval = self.config["monitoring"]["max_interval"]
+    async def run_cycle(self):
+        """执行一次完整检查"""
+        self.check_count += 1
+        logger.info(f"🔍 第 {self.check_count} 次检查开始...")
 
-            logger.info("🔄 开始持续监控模式...")
-            logger.info(f"⏰ 每{min_interval}-{max_interval}秒随机执行一次检查")
-            logger.info("🛑 按 Ctrl+C 可停止程序")
+        if self.dashboard:
+            self.dashboard.update_room(
+                self.target_url,
+                status="检查中(发售)" if self.fast_mode else "检查中",
+                checks=self.check_count,
+            )
+
+        await self.ensure_session()
+        await self.check_peer_sightings()
+
+        # 执行搜索（开启慢检查追踪时同时记录trace）
+        await self.cycle_tracer.start(self.context)
+        if self.profiler:
+            self.profiler.cycle_started()
+        self.cycle_failed = False
+        budget = self.config["monitoring"].get("cycle_budget", 120)
+        deadline = CycleDeadline(budget)
+        started = time.perf_counter()
+        try:
+            # 各阶段自行遵守预算；外层再加宽限时间兜底，保证单轮耗时有上限（未配置预算时不限时）
+            products = await asyncio.wait_for(
+                self.search_all_keywords(deadline),
+                None if budget is None else budget + 5,
+            )
+        except asyncio.TimeoutError:
+            self.cycle_failed = True
+            deadline.overruns.append("cycle")
+            products = []
+        except Exception:
+            self.cycle_failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.record_latency("cycle", elapsed)
+            if self.dashboard:
+                self.dashboard.update_room(self.target_url, cycle_seconds=elapsed)
+            await self.cycle_tracer.stop(
+                self.context, self.check_count, elapsed, self.cycle_failed
+            )
+            if self.profiler:
+                await self.profiler.cycle_finished()
+
+        self.record_overruns(deadline.overruns)
+        if deadline.overruns:
+            logger.warning(
+                f"⏰ 第 {self.check_count} 次检查超出预算的阶段: {', '.join(deadline.overruns)}"
+            )
+
+        if products:
+            logger.info(
+                f"✅ 第 {self.check_count} 次检查完成 - 找到 {len(products)} 个商品"
+            )
+        else:
+            logger.info(f"⚠️ 第 {self.check_count} 次检查完成 - 未找到商品")
+        return products
+
+    async def scan_loop(self):
+        """按配置的检查间隔（或发售窗口调度）循环搜索所有关键字"""
+        while self.is_running:
+            try:
+                now = self.clock.now()
+                phase = self.drop_scheduler.phase(now)
+                if phase == "ramp" and not self.warmed_up:
+                    # 窗口即将开始：校准时钟并预热一次，之后以最快模式检测直到窗口开始
+                    # 先取出即将开始的窗口再校准，校准本身可能跨过窗口开始时间
+                    window_start, _ = self.drop_scheduler.next_window(now)
+                    await self.sync_clock()
+                    await self.warm_up(window_start)
+                    self.warmed_up = True  # 预热失败也不在每轮检查前重复预热
+                    # 校准和预热期间窗口可能已经开始，按当前时间重新判断阶段
+                    phase = self.drop_scheduler.phase(self.clock.now())
+
+                fast_mode = phase in ("active", "ramp")
+                if fast_mode != self.fast_mode:
+                    # 窗口内的连续未命中不代表关键字无效，进出窗口时清除退避
+                    self.keyword_planner.reset_backoff()
+                self.fast_mode = fast_mode
+                if phase == "idle":
+                    self.warmed_up = False
+
+                await self.run_cycle()
+
+                # 按调度阶段计算等待时间
+                now = self.clock.now()
+                wait_time = self.drop_scheduler.next_wait(now)
+                if self.drop_scheduler.phase(now) == "ramp":
+                    window_start, _ = self.drop_scheduler.next_window(now)
+                    if now + wait_time >= window_start:
+                        # 下次检查会越过窗口开始：精确等到窗口开始时立即检查
+                        late_ms = await self.clock.wait_until(window_start)
+                        logger.info(f"🚀 发售窗口开始 (调度误差 {late_ms:.1f} ms)")
+                        continue
+                logger.info(f"⏳ 等待 {wait_time:.1f} 秒后进行下次检查...")
+                if self.dashboard:
+                    self.dashboard.update_room(
+                        self.target_url,
+                        status=f"等待 {wait_time:.0f}s",
+                    )
+
+                # 等待指定时间，期间可以被中断
+                await asyncio.sleep(wait_time)
+
+            except Exception as e:
+                logger.error(f"❌ 第 {self.check_count} 次检查出错: {e}")
+                # 出错后等待30秒再继续
+                logger.info("⏳ 等待30秒后重试...")
+                await asyncio.sleep(30)
+
+    async def watch(self, maxsize=None, overflow=None):
+        """以异步生成器的方式实时产出检测事件
+
+        首个订阅者会启动后台扫描循环，最后一个订阅者退出时扫描循环随之取消。
+        订阅队列写满时按 overflow 策略处理：block 会反压扫描循环，
+        drop_oldest 丢弃最旧的事件。
+        """
+        if self.page is None and not await self.start():
+            return
+
+        subscription = self.subscribe(maxsize, overflow)
+        if self.scan_task is None or self.scan_task.done():
+            self.scan_task = asyncio.create_task(self.scan_loop())
+        scan_task = self.scan_task
+
+        try:
+            while True:
+                getter = asyncio.ensure_future(subscription.get())
+                await asyncio.wait(
+                    {getter, scan_task}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if getter.done():
+                    yield getter.result()
+                    continue
 
-            while self.is_running:
+                # 扫描循环已结束：交付剩余事件后退出
+                getter.cancel()
+                while not subscription.empty():
+                    yield subscription.get_nowait()
+                if not scan_task.cancelled():
+                    scan_task.result()
+                return
+        finally:
+            self.unsubscribe(subscription)
+            if not self.subscribers and not scan_task.done():
+                scan_task.cancel()
                 try:
-                    self.check_count += 1
-                    logger.info(f"🔍 第 {self.check_count} 次检查开始...")
+                    await scan_task
+                except asyncio.CancelledError:
+                    pass
 
-                    # 执行搜索
-                    products = await self.search_all_keywords()
+    async def run_continuous(self):
+        """持续运行程序，基于 watch() 实时输出检测结果"""
+        self.startup_task = asyncio.current_task()
+        try:
+            logger.info("🚀 启动持续监控程序...")
 
-                    if products:
-                        logger.info(
-                            f"✅ 第 {self.check_count} 次检查完成 - 找到 {len(products)} 个商品"
-                        )
-                    else:
-                        logger.info(f"⚠️ 第 {self.check_count} 次检查完成 - 未找到商品")
+            # 初始化浏览器并打开直播间
+            if not await self.start():
+                return False
+            # 启动完成后由扫描循环响应退出信号
+            self.startup_task = None
 
-                    # 使用配置文件中的随机等待时间
-                    wait_time = random.randint(min_interval, max_interval)
-                    logger.info(f"⏳ 等待 {wait_time} 秒后进行下次检查...")
+            min_interval = self.config["monitoring"]["min_interval"]
+            max_interval = self.config["monitoring"]["max_interval"]
 
-                    # 等待指定时间，期间可以被中断
-                    await asyncio.sleep(wait_time)
+            logger.info("🔄 开始持续监控模式...")
+            logger.info(f"⏰ 每{min_interval}-{max_interval}秒随机执行一次检查")
+            logger.info("🛑 按 Ctrl+C 可停止程序")
 
-                except KeyboardInterrupt:
-                    logger.info("⭕ 接收到中断信号，停止监控...")
-                    self.is_running = False
-                    break
-                except Exception as e:
-                    logger.error(f"❌ 第 {self.check_count} 次检查出错: {e}")
-                    # 出错后等待30秒再继续
-                    logger.info("⏳ 等待30秒后重试...")
-                    await asyncio.sleep(30)
+            async for detection in self.watch():
+                logger.info(
+                    f"🎯 实时检测: 关键字 '{detection.keyword}' -> "
+                    f"{detection.text[:100]}"
+                )
 
             logger.info(f"🏁 监控结束，总共执行了 {self.check_count} 次检查")
             return True
@@ -606,27 +3616,450 @@ class TaobaoLiveSearcher:
             logger.info("⭕ 程序被用户中断")
             self.is_running = False
             return False
+        except asyncio.CancelledError:
+            # 启动阶段收到退出信号：跳过剩余启动步骤直接清理；其它来源的取消继续向上传递
+            if self.is_running:
+                raise
+            logger.info("⭕ 启动已取消")
+            return False
         except Exception as e:
             logger.error(f"❌ 持续监控程序出错: {e}")
             return False
         finally:
+            self.startup_task = None
             await self.cleanup()
 
+    def request_shutdown(self, reason="收到退出信号"):
+        """停止扫描：取消扫描循环，watch() 随之结束并进入 cleanup
+
+        仍在启动阶段（安装浏览器、打开直播间）时直接取消启动，立即进入 cleanup。
+        """
+        timeout = self.config.get("shutdown", {}).get("timeout", 10)
+        if not self.is_running:
+            logger.info(f"🛑 正在退出，最多等待 {timeout} 秒...")
+            return
+        logger.info(f"🛑 {reason}，停止扫描并在 {timeout} 秒内退出...")
+        self.is_running = False
+        if self.scan_task and not self.scan_task.done():
+            self.scan_task.cancel()
+        elif self.startup_task and not self.startup_task.done():
+            self.startup_task.cancel()
+
+    async def shutdown_step(self, deadline, stage, awaitable):
+        """在退出预算内执行一个收尾步骤，超时或出错只记录日志，返回是否完成"""
+        try:
+            await deadline.run(stage, awaitable)
+            return True
+        except DeadlineExceeded:
+            logger.warning(f"⏰ 退出步骤超时已放弃: {stage}")
+        except Exception as e:
+            logger.error(f"❌ 退出步骤失败 {stage}: {e}")
+        return False
+
+    async def cancel_tasks(self):
+        """取消扫描循环、后台任务和详情页处理协程"""
+        tasks = [
+            task
+            for task in [self.scan_task, self.metrics_task, *self.background_tasks]
+            if task and not task.done()
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.metrics_task = None
+        await self.stop_product_workers()
+
+    async def close_pages(self):
+        """并行关闭所有页面"""
+        if not self.context:
+            return
+        await asyncio.gather(
+            *(page.close() for page in self.context.pages), return_exceptions=True
+        )
+
     async def cleanup(self):
-        """清理资源"""
+        """清理资源，总耗时不超过 shutdown.timeout 秒
+
+        先取消进行中的任务并写入历史、证据和日志，再并行关闭页面，最后关闭上下文和浏览器。
+        前半段最多使用一半预算，保证浏览器总有时间关闭。
+        """
+        timeout = self.config.get("shutdown", {}).get("timeout", 10)
+        deadline = CycleDeadline(timeout)
+        drain_deadline = deadline.share(0.5)
+        started = time.perf_counter()
+        self.is_running = False
         try:
-            if self.browser:
-                await self.browser.close()
-                logger.info("🧹 浏览器已关闭")
+            await self.shutdown_step(
+                drain_deadline, "cancel_tasks", self.cancel_tasks()
+            )
+
+            if self.dashboard:
+                self.dashboard.stop()
+                self.dashboard = None
+            if self.lag_monitor:
+                # 退出前写入最后一次事件循环延迟统计
+                metrics = self.lag_monitor.percentiles()
+                if metrics:
+                    self.record_loop_lag(metrics)
+                if self.record_loop_lag in self.lag_monitor.reporters:
+                    self.lag_monitor.reporters.remove(self.record_loop_lag)
+                if not self.lag_monitor.reporters:
+                    self.lag_monitor.stop()
+                self.lag_monitor = None
+            if self.profiler:
+                await self.shutdown_step(
+                    drain_deadline, "profiler", self.profiler.stop()
+                )
+                self.profiler = None
+            await self.shutdown_step(
+                drain_deadline,
+                "evidence",
+                self.evidence.close(timeout=drain_deadline.remaining()),
+            )
+            if self.history:
+                await self.shutdown_step(
+                    drain_deadline, "history", self.history.flush()
+                )
+                self.history.close()
+            if self.ledger:
+                # 等待线程池中仍在进行的账本操作结束后再关闭
+                await self.shutdown_step(
+                    drain_deadline, "ledger", asyncio.to_thread(self.ledger.close)
+                )
+            for handler in logging.getLogger().handlers:
+                handler.flush()
+
+            await self.shutdown_step(deadline, "close_pages", self.close_pages())
+
+            # 快照模式下context与browser不同，需要单独关闭
+            if self.context and self.context is not self.browser:
+                await self.shutdown_step(deadline, "context", self.context.close())
+
+            # 共享browser（未自行启动playwright）由工作进程负责关闭
+            if self.browser and self.playwright:
+                if await self.shutdown_step(deadline, "browser", self.browser.close()):
+                    logger.info("🧹 浏览器已关闭")
 
             if self.playwright:
-                await self.playwright.stop()
-                logger.info("🧹 Playwright资源已清理")
+                # 即使预算已用完也留出片刻停止驱动进程，避免残留Chromium
+                if await self.shutdown_step(
+                    CycleDeadline(max(deadline.remaining(), 2)),
+                    "playwright",
+                    self.playwright.stop(),
+                ):
+                    logger.info("🧹 Playwright资源已清理")
         except Exception as e:
             logger.error(f"❌ 清理失败: {e}")
+        finally:
+            logger.info(f"🏁 退出清理耗时 {time.perf_counter() - started:.2f} 秒")
+            for handler in logging.getLogger().handlers:
+                handler.flush()
+
+
+async def export_storage_state(config_file, path):
+    """从持久化用户目录导出一次登录状态快照"""
+    searcher = TaobaoLiveSearcher(config_file)
+    try:
+        if not await searcher.setup_browser():
+            return False
+        state = await searcher.context.storage_state()
+        # 快照包含完整的登录Cookie，仅允许当前用户读写
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.chmod(path, 0o600)
+        logger.info(f"💾 已导出登录状态快照: {path}")
+        return True
+    except Exception as e:
+        logger.error(f"❌ 导出登录状态快照失败: {e}")
+        return False
+    finally:
+        await searcher.cleanup()
+
+
+async def run_shard(config_file, shard_id, rooms, storage_state, detection_queue):
+    """工作进程主逻辑：一个浏览器，分片内每个直播间一个上下文"""
+    playwright = await async_playwright().start()
+    browser = None
+    try:
+        config = TaobaoLiveSearcher.load_config(config_file)
+        browser = await playwright.chromium.launch(
+            headless=config["browser"]["headless"],
+            args=config["browser"]["args"],
+        )
+
+        searchers = []
+        for room in rooms:
+            searcher = TaobaoLiveSearcher(
+                config_file,
+                target_url=room,
+                storage_state=storage_state,
+                detection_queue=detection_queue,
+                shard_id=shard_id,
+            )
+            searcher.browser = browser  # 共享工作进程的浏览器
+            searchers.append(searcher)
+
+        # 协调进程通过 SIGTERM 结束工作进程，Ctrl+C 的 SIGINT 也会发到工作进程：
+        # 与单进程模式一样停止扫描并在限定时间内写入历史、关闭页面后退出
+        def request_shutdown(name):
+            for searcher in searchers:
+                searcher.request_shutdown(f"分片 {shard_id} 收到 {name}")
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, request_shutdown, sig.name)
+            except (NotImplementedError, RuntimeError):
+                continue
 
+        logger.info(f"🧩 分片 {shard_id} 启动，负责 {len(rooms)} 个直播间")
+        await asyncio.gather(*(searcher.run_continuous() for searcher in searchers))
+    finally:
+        if browser:
+            await browser.close()
+        await playwright.stop()
 
-async def main():
+
+def shard_worker(config_file, shard_id, rooms, storage_state, detection_queue):
+    """工作进程入口（需位于模块顶层以便spawn方式启动）"""
+    try:
+        asyncio.run(
+            run_shard(config_file, shard_id, rooms, storage_state, detection_queue)
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+class ShardCoordinator:
+    """多进程分片协调器：导出登录快照、分配直播间并汇总去重检测结果"""
+
+    def __init__(self, config_file="config.yaml", workers=None):
+        self.config_file = config_file
+        self.config = TaobaoLiveSearcher.load_config(config_file)
+
+        sharding_config = self.config.get("sharding", {})
+        self.rooms = self.config.get("target_urls") or [self.config["target_url"]]
+        self.workers = min(
+            workers or sharding_config.get("workers", 1), len(self.rooms)
+        )
+        self.storage_state = os.path.join(
+            os.getcwd(), sharding_config.get("storage_state", "storage_state.json")
+        )
+        self.dedup_seconds = sharding_config.get("dedup_seconds", 300)
+        self.processes = []
+        self.seen = {}  # (room, 商品标识) -> 最近一次上报时间
+
+    def split_rooms(self):
+        """按轮询方式将直播间分配到各个工作进程"""
+        return [self.rooms[i :: self.workers] for i in range(self.workers)]
+
+    def is_duplicate(self, detection):
+        """同一直播间的同一商品在去重窗口内只上报一次"""
+        key = (
+            detection["room"],
+            detection.get("goods_num") or detection["text"],
+        )
+        now = detection.get("detected_at", time.time())
+        last_seen = self.seen.get(key)
+        self.seen[key] = now
+        return last_seen is not None and now - last_seen < self.dedup_seconds
+
+    def report(self, detection):
+        """输出一条去重后的检测结果"""
+        logger.info(
+            f"🎯 [分片 {detection['shard_id']}] {detection['room']} "
+            f"关键字 '{detection['keyword']}' 命中: {detection['text'][:100]}"
+        )
+        if detection.get("goods_num"):
+            logger.info(f"   商品编号: {detection['goods_num']}")
+
+    async def run(self):
+        """导出快照、启动工作进程并持续汇总检测结果"""
+        try:
+            if not await export_storage_state(self.config_file, self.storage_state):
+                return False
+
+            # playwright在fork出的子进程中不可用，统一使用spawn
+            mp_context = multiprocessing.get_context("spawn")
+            detection_queue = mp_context.Queue()
+
+            for shard_id, rooms in enumerate(self.split_rooms()):
+                process = mp_context.Process(
+                    target=shard_worker,
+                    args=(
+                        self.config_file,
+                        shard_id,
+                        rooms,
+                        self.storage_state,
+                        detection_queue,
+                    ),
+                    name=f"labubu-shard-{shard_id}",
+                )
+                process.start()
+                self.processes.append(process)
+
+            logger.info(
+                f"🧩 已启动 {len(self.processes)} 个工作进程，共 {len(self.rooms)} 个直播间"
+            )
+
+            loop = asyncio.get_running_loop()
+            while any(process.is_alive() for process in self.processes):
+                try:
+                    detection = await loop.run_in_executor(
+                        None, detection_queue.get, True, 1.0
+                    )
+                except queue.Empty:
+                    continue
+
+                if not self.is_duplicate(detection):
+                    self.report(detection)
+            return True
+        finally:
+            # terminate() 发送 SIGTERM，工作进程在 shutdown.timeout 内写入历史并关闭浏览器
+            for process in self.processes:
+                if process.is_alive():
+                    process.terminate()
+            grace = self.config.get("shutdown", {}).get("timeout", 10) + 5
+            for process in self.processes:
+                process.join(timeout=grace)
+                if process.is_alive():
+                    logger.warning(f"⚠️ 工作进程 {process.name} 未按时退出，强制结束")
+                    process.kill()
+                    process.join()
+            if self.processes:
+                logger.info("🏁 所有工作进程已结束")
+            # 登录快照只在本次运行中使用，退出时删除
+            try:
+                os.remove(self.storage_state)
+            except FileNotFoundError:
+                pass
+
+
+async def compact_profile(config_file):
+    """按需压缩用户目录，并报告压缩前后的浏览器启动耗时"""
+
+    async def measure_launch():
+        searcher = TaobaoLiveSearcher(config_file)
+        searcher.profile_config = {**searcher.profile_config, "auto_compact": False}
+        try:
+            if not await searcher.setup_browser():
+                return None
+            return searcher.launch_seconds
+        finally:
+            await searcher.cleanup()
+
+    searcher = TaobaoLiveSearcher(config_file)
+    compactor = searcher.profile_compactor
+    if not os.path.isdir(searcher.user_data_dir):
+        print(f"❌ 用户数据目录不存在: {searcher.user_data_dir}")
+        return 1
+
+    launch_before = await measure_launch()
+    size_before, size_after = await asyncio.to_thread(compactor.compact)
+    launch_after = await measure_launch()
+
+    print("🧹 用户目录压缩完成")
+    print("=" * 50)
+    print(
+        f"📁 目录大小: {size_before / 1024 / 1024:.1f} MB -> {size_after / 1024 / 1024:.1f} MB"
+    )
+    if launch_before is not None and launch_after is not None:
+        print(f"⏱️ 启动耗时: {launch_before:.2f} 秒 -> {launch_after:.2f} 秒")
+    print("=" * 50)
+    return 0
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="淘宝直播间LABUBU商品搜索程序")
+    parser.add_argument(
+        "--config", default="config.yaml", help="配置文件路径 (默认: config.yaml)"
+    )
+    parser.add_argument(
+        "--dashboard",
+        action="store_true",
+        help="以终端面板模式运行，日志写入文件 (默认取配置 dashboard.enabled)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="分片工作进程数量，大于1时以协调模式运行 (默认取配置 sharding.workers)",
+    )
+
+    subparsers = parser.add_subparsers(dest="command")
+    history_parser = subparsers.add_parser("history", help="查询检测历史")
+    history_parser.add_argument(
+        "report", choices=["appearances", "latency"], help="查询类型"
+    )
+    history_parser.add_argument("--goods", help="按商品编号过滤")
+    history_parser.add_argument("--keyword", help="按关键字过滤")
+    history_parser.add_argument("--stage", help="按阶段过滤 (latency)")
+    history_parser.add_argument("--days", type=int, default=30, help="统计天数")
+    subparsers.add_parser("compact-profile", help="压缩用户数据目录并报告启动耗时变化")
+    return parser.parse_args(argv)
+
+
+def run_history_cli(args):
+    """命令行查询检测历史"""
+    config = TaobaoLiveSearcher.load_config(args.config)
+    path = config.get("history", {}).get("path", "history.db")
+    if not os.path.exists(path):
+        print(f"❌ 检测历史不存在: {path}")
+        return 1
+
+    history = DetectionHistory(path)
+    history.open()
+    try:
+        if args.report == "appearances":
+            patterns = history.appearance_patterns(args.goods, args.keyword, args.days)
+            print(f"📈 最近 {args.days} 天商品出现规律 ({len(patterns)} 个商品)")
+            print("=" * 60)
+            for pattern in patterns:
+                hours = ", ".join(
+                    f"{hour}点({count}天)" for hour, count in pattern["common_hours"]
+                )
+                print(f"🔍 商品: {pattern['item']}")
+                print(f"  关键字: {pattern['keyword']}")
+                print(
+                    f"  首次出现: {datetime.fromtimestamp(pattern['first_seen']):%Y-%m-%d %H:%M:%S}"
+                    f"  最近出现: {datetime.fromtimestamp(pattern['last_seen']):%Y-%m-%d %H:%M:%S}"
+                )
+                print(
+                    f"  出现天数: {pattern['days']}  出现次数: {pattern['sightings']}"
+                    f"  平均在架: {pattern['avg_shelf_seconds'] / 60:.1f} 分钟"
+                )
+                print(f"  常见时段: {hours}")
+                print("  " + "-" * 30)
+        else:
+            trends = history.latency_trends(args.stage, args.days)
+            print(f"⏱️ 最近 {args.days} 天各阶段耗时趋势 (毫秒)")
+            print("=" * 60)
+            print(
+                f"{'日期':<12}{'阶段':<14}{'次数':>6}{'平均':>10}{'P50':>10}{'P95':>10}{'最大':>10}"
+            )
+            for trend in trends:
+                print(
+                    f"{trend['day']:<12}{trend['stage']:<14}{trend['count']:>6}"
+                    f"{trend['avg_ms']:>10.1f}{trend['p50_ms']:>10.1f}"
+                    f"{trend['p95_ms']:>10.1f}{trend['max_ms']:>10.1f}"
+                )
+            overruns = history.overrun_counts(args.stage, args.days)
+            if overruns:
+                print()
+                print("⏰ 超出时间预算的阶段")
+                print(f"{'日期':<12}{'阶段':<14}{'次数':>6}")
+                for overrun in overruns:
+                    print(
+                        f"{overrun['day']:<12}{overrun['stage']:<14}{overrun['count']:>6}"
+                    )
+        return 0
+    finally:
+        history.close()
+
+
+async def main(args=None):
     """主函数"""
     print("🎭 淘宝直播间LABUBU商品搜索程序")
     print("=" * 50)
@@ -651,8 +4084,12 @@ async def main():
     print("=" * 50)
     print()
 
+    args = args or parse_args()
+
     try:
-        searcher = TaobaoLiveSearcher()
+        searcher = TaobaoLiveSearcher(args.config)
+        if args.dashboard:
+            searcher.config.setdefault("dashboard", {})["enabled"] = True
 
         # 显示当前配置信息
         print(f"📍 目标直播间: {searcher.target_url}")
@@ -662,16 +4099,29 @@ async def main():
         )
         print("=" * 50)
 
+        workers = args.workers or searcher.config.get("sharding", {}).get("workers", 1)
+        rooms = searcher.config.get("target_urls") or []
+        if workers > 1 or len(rooms) > 1:
+            # 配置了多个直播间时即使只有一个工作进程也按分片模式运行，否则target_urls会被忽略
+            print(f"多进程分片模式 ({workers} 个工作进程)")
+            print("=" * 50)
+            await ShardCoordinator(args.config, workers).run()
+            return
+
         print("持续监控模式")
         print("=" * 50)
 
-        # 让用户选择运行模式
-        while True:
+        # Ctrl+C / SIGTERM：停止扫描并在限定时间内退出（Windows下由KeyboardInterrupt取消任务）
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
             try:
-                await searcher.run_continuous()
-            except KeyboardInterrupt:
-                print("\n❌ 程序已取消")
-                return
+                loop.add_signal_handler(
+                    sig, searcher.request_shutdown, f"收到 {sig.name}"
+                )
+            except (NotImplementedError, RuntimeError):
+                continue
+
+        await searcher.run_continuous()
     except Exception as e:
         print(f"❌ 配置加载失败: {e}")
         print("请确保config.yaml文件存在且格式正确")
@@ -679,4 +4129,12 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    if args.command == "history":
+        sys.exit(run_history_cli(args))
+    if args.command == "compact-profile":
+        sys.exit(asyncio.run(compact_profile(args.config)))
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        print("\n❌ 程序已取消")